@@ -0,0 +1,69 @@
+"""Compare the trie-compiled damage word matcher with the original regex alternation.
+
+Run from the repository root:
+    python -m benchmarks.bench_filter --tweets 200000
+"""
+import time
+import random
+import argparse
+import pandas as pd
+from word_list import damage_words_english, damage_words_japanese
+from keyword_matcher import KeywordMatcher
+
+FILLER_WORDS = ['earthquake', 'shaking', 'felt', 'house', 'road', 'today', 'wow', 'california', 'ridgecrest',
+                'everyone', 'okay', 'strong', 'aftershock', 'the', 'a', 'was', 'in', 'my', 'we', 'still']
+FILLER_JAPANESE = ['地震', '揺れ', '今日', '家', '道路', '大丈夫', 'すごい', 'みんな', '余震', 'です']
+
+
+def legacy_filter(texts, language):
+    """Filter texts with the original single regex alternation."""
+    if language == 'english':
+        pattern = '|'.join(r'\b{}\b'.format(word) for word in damage_words_english)
+    else:
+        pattern = '|'.join(damage_words_japanese)
+    return texts.str.contains(pattern, case=False, na=False)
+
+
+def synthetic_texts(n, language, damage_rate=0.2, seed=0):
+    """Generate n tweet-like texts, about damage_rate of which contain a damage word."""
+    rng = random.Random(seed)
+    filler = FILLER_WORDS if language == 'english' else FILLER_JAPANESE
+    damage = damage_words_english if language == 'english' else damage_words_japanese
+    separator = ' ' if language == 'english' else ''
+    texts = []
+    for _ in range(n):
+        words = rng.choices(filler, k=rng.randint(8, 30))
+        if rng.random() < damage_rate:
+            word = rng.choice(damage)
+            words.insert(rng.randrange(len(words)), word.upper() if rng.random() < 0.1 else word)
+        texts.append(separator.join(words))
+    return pd.Series(texts)
+
+
+def timed(function, *args):
+    """Return the result of function(*args) and the seconds it took."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(n, language):
+    texts = synthetic_texts(n, language)
+    matcher, build_seconds = timed(KeywordMatcher, damage_words_english if language == 'english' else damage_words_japanese, language == 'english')
+    legacy, legacy_seconds = timed(legacy_filter, texts, language)
+    trie, trie_seconds = timed(matcher.contains, texts)
+    terms, terms_seconds = timed(matcher.matches, texts[trie])
+    assert legacy.equals(trie), 'trie matcher disagrees with the legacy regex'
+    print(f'{language}: {n} tweets, {int(trie.sum())} matched (matcher built in {build_seconds * 1000:.1f} ms)')
+    print(f'  legacy regex : {legacy_seconds:.3f} s ({n / legacy_seconds:,.0f} tweets/s)')
+    print(f'  trie matcher : {trie_seconds:.3f} s ({n / trie_seconds:,.0f} tweets/s)')
+    print(f'  matched terms: {terms_seconds:.3f} s for {len(terms)} tweets')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the damage word filter.')
+    parser.add_argument('--tweets', type=int, default=200000, help='Number of synthetic tweets (default: 200000)')
+    parser.add_argument('--language', type=str, default='both', choices=['english', 'japanese', 'both'], help='Language to benchmark (default: both)')
+    args = parser.parse_args()
+    for language in (['english', 'japanese'] if args.language == 'both' else [args.language]):
+        main(args.tweets, language)
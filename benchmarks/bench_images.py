@@ -0,0 +1,75 @@
+"""Compare vision request payloads before and after image preprocessing.
+
+Measures the base64 payload size of the original files against the
+downscaled, re-encoded payload of ImagePreprocessor, and the time to
+prepare each image. Uses the images in a folder if given, otherwise a set of
+synthetic photos and screenshots. Run from the repository root:
+    python -m benchmarks.bench_images [folder] [--max-edge 1024] [--format jpeg]
+"""
+import os
+import io
+import time
+import base64
+import argparse
+import tempfile
+import numpy as np
+import PIL.Image
+from image_preprocess import ImagePreprocessor, MAX_EDGE, QUALITY, FORMATS
+
+
+def synthetic_images(folder):
+    """Write photo-like and screenshot-like test images of typical tweet sizes to folder."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for index, (width, height, kind, format) in enumerate([(4032, 3024, 'photo', 'JPEG'), (2048, 1536, 'photo', 'PNG'),
+                                                           (1170, 2532, 'screenshot', 'PNG'), (1200, 675, 'photo', 'JPEG'),
+                                                           (800, 600, 'screenshot', 'PNG')]):
+        y, x = np.mgrid[0:height, 0:width]
+        if kind == 'photo':
+            pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+            pixels = pixels + rng.normal(0, 12, pixels.shape)
+        else:
+            pixels = np.full((height, width, 3), 245.0)
+            pixels[(y // 40) % 3 == 0] = 30
+        img = PIL.Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        path = os.path.join(folder, f'{kind}{index}.{format.lower()}')
+        img.save(path, format, quality=92)
+        paths.append(path)
+    return paths
+
+
+def main(folder, max_edge, format, quality):
+    with tempfile.TemporaryDirectory() as workdir:
+        if folder:
+            paths = sorted(os.path.join(folder, file) for file in os.listdir(folder))
+        else:
+            paths = synthetic_images(workdir)
+        preprocessor = ImagePreprocessor(max_edge, format, quality, cache_dir=None)
+        total_before = total_after = total_time = 0
+        for path in paths:
+            with open(path, 'rb') as f:
+                before = len(base64.b64encode(f.read()))
+            start = time.perf_counter()
+            try:
+                data, mime = preprocessor.prepare(path)
+            except (OSError, PIL.Image.DecompressionBombError):
+                continue
+            elapsed = time.perf_counter() - start
+            after = len(base64.b64encode(data))
+            size = PIL.Image.open(io.BytesIO(data)).size
+            total_before, total_after, total_time = total_before + before, total_after + after, total_time + elapsed
+            print(f'{os.path.basename(path):<28}{before / 1024:10.0f} KiB -> {after / 1024:8.0f} KiB  '
+                  f'{mime:<11}{size[0]:>5}x{size[1]:<5}{elapsed * 1000:8.1f} ms')
+        if total_before:
+            print(f'{"total":<28}{total_before / 1024:10.0f} KiB -> {total_after / 1024:8.0f} KiB  '
+                  f'({total_after / total_before:.0%} of the original payload, {total_time:.2f} s to prepare)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare image payload sizes before and after preprocessing.')
+    parser.add_argument('folder', nargs='?', default=None, help='Folder of images (default: synthetic images)')
+    parser.add_argument('--max-edge', type=int, default=MAX_EDGE, help=f'Longest edge after downscaling (default: {MAX_EDGE})')
+    parser.add_argument('--format', type=str, default='jpeg', choices=sorted(FORMATS), help='Re-encoding format (default: jpeg)')
+    parser.add_argument('--quality', type=int, default=QUALITY, help=f'Encoder quality (default: {QUALITY})')
+    args = parser.parse_args()
+    main(args.folder, args.max_edge, args.format, args.quality)
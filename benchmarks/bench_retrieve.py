@@ -0,0 +1,217 @@
+"""Compare the declarative column-wise tweet converter with the original per-tweet one.
+
+Generates synthetic tweets with photos, places, retweets and quotes, checks
+that both converters produce the same table, and reports tweets per second
+for parsing, conversion and the text rewrite; the new path runs with the
+garbage collector paused, as retrieve_json does. Run from the repository root:
+    python -m benchmarks.bench_retrieve --tweets 100000
+"""
+import json
+import time
+import random
+import argparse
+import pandas as pd
+from retrieve_json import PARSER, loads, gc_paused, convert_dataframe, convert_text, convert_texts
+
+TEXTS = ['the wall collapsed downtown', 'nice day in the desert', 'building damaged near the school',
+         'cracks everywhere in the road', 'felt that one: strong shaking', 'power is out, stay safe']
+
+
+def synthetic_user(rng, index):
+    """Return a synthetic Twitter user object."""
+    return {'screen_name': f'user{index}', 'name': f'User {index}', 'description': rng.choice(['', 'Ridgecrest local', None]),
+            'location': rng.choice(['Ridgecrest, CA', '', 'LA']), 'protected': False, 'verified': rng.random() < 0.05,
+            'created_at': 'Mon Jul 01 00:00:00 +0000 2013', 'followers_count': rng.randrange(10 ** 6),
+            'friends_count': rng.randrange(5000), 'listed_count': rng.randrange(100), 'favourites_count': rng.randrange(10 ** 5),
+            'statuses_count': rng.randrange(10 ** 5), 'default_profile': rng.random() < 0.5, 'default_profile_image': False}
+
+
+def synthetic_tweet(rng, index, image_url=None, embed=True):
+    """Return a synthetic tweet in the format of the Twitter API v1.1 with tweet_mode=extended.
+
+    About a third of the tweets are retweets, one in eight quotes another
+    tweet and one in four has photos; image_url maps a photo number to its URL.
+    """
+    image_url = image_url or (lambda number: f'https://pbs.twimg.com/media/synthetic{number}.jpg')
+    tweet = {'user': synthetic_user(rng, rng.randrange(10 ** 5)), 'id': 1147000000000000000 + index,
+             'created_at': f'Sat Jul 06 {rng.randrange(24):02d}:{rng.randrange(60):02d}:00 +0000 2019',
+             'full_text': rng.choice(TEXTS), 'retweet_count': rng.randrange(100), 'favorite_count': rng.randrange(100),
+             'in_reply_to_screen_name': rng.choice([None, None, 'someone']), 'lang': rng.choice(['en', 'en', 'ja'])}
+    if rng.random() < 0.25:
+        photos = [{'type': 'photo', 'media_url_https': image_url(rng.randrange(10 ** 6))} for _ in range(rng.randint(1, 4))]
+        tweet['entities'] = {'media': photos[:1]}
+        tweet['extended_entities'] = {'media': photos + [{'type': 'video', 'media_url_https': image_url(0)}]}
+    if rng.random() < 0.1:
+        tweet['place'] = {'full_name': 'Ridgecrest, CA', 'country_code': 'US'}
+        tweet['coordinates'] = {'type': 'Point', 'coordinates': [-117.6 + rng.uniform(-1, 1), 35.7 + rng.uniform(-1, 1)]}
+    if embed and rng.random() < 0.35:
+        retweeted = synthetic_tweet(rng, index + 10 ** 9, image_url, embed=False)
+        tweet['retweeted_status'] = retweeted
+        tweet['full_text'] = f"RT @{retweeted['user']['screen_name']}: {retweeted['full_text'][:20]}"
+    if embed and rng.random() < 0.125:
+        tweet['quoted_status'] = synthetic_tweet(rng, index + 2 * 10 ** 9, image_url, embed=False)
+    return tweet
+
+
+def synthetic_lines(n, seed=0, image_url=None):
+    """Return n synthetic tweets as JSON lines."""
+    rng = random.Random(seed)
+    return [json.dumps(synthetic_tweet(rng, index, image_url)).encode('utf-8') for index in range(n)]
+
+
+def legacy_convert_dataframe(tweets_data):
+    """The original per-tweet dict building converter of retrieve_json, with its coordinates fix."""
+    tweets_list = []
+    for tweet in tweets_data:
+        # tweet basic information
+        tweet_dict = {'user': tweet['user']['screen_name'],
+                      'user_name': tweet['user']['name'],
+                      'description': tweet['user']['description'],
+                      'location': tweet['user']['location'],
+                      'protected': tweet['user']['protected'],
+                      'verified': tweet['user']['verified'],
+                      'created': tweet['user']['created_at'],
+                      'followers': tweet['user']['followers_count'],
+                      'friends': tweet['user']['friends_count'],
+                      'listed': tweet['user']['listed_count'],
+                      'favourites': tweet['user']['favourites_count'],
+                      'statuses': tweet['user']['statuses_count'],
+                      'default_profile': tweet['user']['default_profile'],
+                      'default_image': tweet['user']['default_profile_image'],
+                      'time': tweet['created_at'],
+                      'id': tweet['id'],
+                      'text': tweet['full_text'],
+                      'retweet_count': tweet['retweet_count'],
+                      'favourite_count': tweet['favorite_count'],
+                      'reply': tweet['in_reply_to_screen_name'],
+                      'language': tweet['lang'], 
+                      'entity_image_url': '',
+                      'extended_entity_image_urls': [],
+                      'place': '',
+                      'latitude': '',
+                      'longitude': ''}
+        
+        # place information
+        if 'place' in tweet:
+            tweet_dict['place'] = tweet['place']
+        if 'coordinates' in tweet and tweet['coordinates'] is not None:
+            tweet_dict['longitude'] = tweet['coordinates']['coordinates'][0]
+            tweet_dict['latitude'] = tweet['coordinates']['coordinates'][1]
+        
+        # image information
+        if 'entities' in tweet and 'media' in tweet['entities']:
+            for media in tweet['entities']['media']:
+                if media['type'] == 'photo':
+                    tweet_dict['entity_image_url'] = media['media_url_https']
+                    break
+        if 'extended_entities' in tweet and 'media' in tweet['extended_entities']:
+            for media in tweet['extended_entities']['media']:
+                if media['type'] == 'photo':
+                    tweet_dict['extended_entity_image_urls'].append(media['media_url_https'])
+
+        # retweet information
+        if 'retweeted_status' in tweet:
+            tweet_dict['rt_user'] = tweet['retweeted_status']['user']['screen_name']
+            tweet_dict['rt_user_name'] = tweet['retweeted_status']['user']['name']
+            tweet_dict['rt_description'] = tweet['retweeted_status']['user']['description']
+            tweet_dict['rt_location'] = tweet['retweeted_status']['user']['location']
+            tweet_dict['rt_protected'] = tweet['retweeted_status']['user']['protected']
+            tweet_dict['rt_verified'] = tweet['retweeted_status']['user']['verified']
+            tweet_dict['rt_created'] = tweet['retweeted_status']['user']['created_at']
+            tweet_dict['rt_followers'] = tweet['retweeted_status']['user']['followers_count']
+            tweet_dict['rt_friends'] = tweet['retweeted_status']['user']['friends_count']
+            tweet_dict['rt_listed'] = tweet['retweeted_status']['user']['listed_count']
+            tweet_dict['rt_favourites'] = tweet['retweeted_status']['user']['favourites_count']
+            tweet_dict['rt_statuses'] = tweet['retweeted_status']['user']['statuses_count']
+            tweet_dict['rt_default_profile'] = tweet['retweeted_status']['user']['default_profile']
+            tweet_dict['rt_default_image'] = tweet['retweeted_status']['user']['default_profile_image']
+            tweet_dict['rt_time'] = tweet['retweeted_status']['created_at']
+            tweet_dict['rt_id'] = tweet['retweeted_status']['id']
+            tweet_dict['rt_text'] = tweet['retweeted_status']['full_text']
+            tweet_dict['rt_retweet_count'] = tweet['retweeted_status']['retweet_count']
+            tweet_dict['rt_favourite_count'] = tweet['retweeted_status']['favorite_count']            
+            tweet_dict['rt_reply'] = tweet['retweeted_status']['in_reply_to_screen_name']
+            tweet_dict['rt_language'] = tweet['retweeted_status']['lang']
+       
+        # quote information
+        if 'quoted_status' in tweet:
+            tweet_dict['qt_user'] = tweet['quoted_status']['user']['screen_name']
+            tweet_dict['qt_user_name'] = tweet['quoted_status']['user']['name']
+            tweet_dict['qt_description'] = tweet['quoted_status']['user']['description']
+            tweet_dict['qt_location'] = tweet['quoted_status']['user']['location']
+            tweet_dict['qt_protected'] = tweet['quoted_status']['user']['protected']
+            tweet_dict['qt_verified'] = tweet['quoted_status']['user']['verified']
+            tweet_dict['qt_created'] = tweet['quoted_status']['user']['created_at']
+            tweet_dict['qt_followers'] = tweet['quoted_status']['user']['followers_count']
+            tweet_dict['qt_friends'] = tweet['quoted_status']['user']['friends_count']
+            tweet_dict['qt_listed'] = tweet['quoted_status']['user']['listed_count']
+            tweet_dict['qt_favourites'] = tweet['quoted_status']['user']['favourites_count']
+            tweet_dict['qt_statuses'] = tweet['quoted_status']['user']['statuses_count']
+            tweet_dict['qt_default_profile'] = tweet['quoted_status']['user']['default_profile']
+            tweet_dict['qt_default_image'] = tweet['quoted_status']['user']['default_profile_image']
+            tweet_dict['qt_time'] = tweet['quoted_status']['created_at']
+            tweet_dict['qt_id'] = tweet['quoted_status']['id']
+            tweet_dict['qt_text'] = tweet['quoted_status']['full_text']
+            tweet_dict['qt_retweet'] = tweet['quoted_status']['retweet_count']
+            tweet_dict['qt_favourite_count'] = tweet['quoted_status']['favorite_count']    
+            tweet_dict['qt_reply'] = tweet['quoted_status']['in_reply_to_screen_name']
+            tweet_dict['qt_language'] = tweet['quoted_status']['lang']  
+        
+        tweets_list.append(tweet_dict)
+    df = pd.DataFrame(tweets_list)
+    return df
+
+
+def legacy_convert_texts(df):
+    """The original row-wise text rewrite of retrieve_json.main."""
+    df['text'] = df.apply(lambda row: convert_text(str(row['text']), str(row['rt_text'])), axis=1)
+    return df
+
+
+def assert_same(legacy, new):
+    """Check that the new converter reproduces the legacy table.
+
+    Integer columns of the retweet and quote blocks are nullable integers in
+    the new table and floats in the legacy one, so they are compared as floats.
+    """
+    assert list(legacy.columns) == list(new.columns), 'column order differs'
+    for column in legacy.columns:
+        expected, actual = legacy[column], new[column]
+        if actual.dtype == 'Int64':
+            actual = actual.astype('float64')
+            expected = expected.astype('float64')
+        pd.testing.assert_series_equal(expected, actual, obj=column)
+
+
+def timed(function, *args):
+    """Return the result of function(*args) and the seconds it took."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(n, seed):
+    lines = synthetic_lines(n, seed)
+    legacy_tweets, legacy_parse = timed(lambda: [json.loads(line) for line in lines])
+    legacy, legacy_convert = timed(legacy_convert_dataframe, legacy_tweets)
+    legacy, legacy_text = timed(legacy_convert_texts, legacy)
+    with gc_paused():
+        tweets, parse = timed(lambda: [loads(line) for line in lines])
+        new, convert = timed(convert_dataframe, tweets)
+        new, text = timed(convert_texts, new)
+    assert_same(legacy, new)
+    ids = [tweet['retweeted_status']['id'] for tweet in tweets if 'retweeted_status' in tweet]
+    assert new['rt_id'].dropna().tolist() == ids, 'retweet ids lost precision'
+    print(f'{n} synthetic tweets, {len(ids)} retweets, parser: {PARSER}')
+    for stage, before, after in [('parse', legacy_parse, parse), ('convert', legacy_convert, convert),
+                                 ('text', legacy_text, text),
+                                 ('total', legacy_parse + legacy_convert + legacy_text, parse + convert + text)]:
+        print(f'{stage:<9}legacy {n / before:12,.0f} tweets/s   new {n / after:12,.0f} tweets/s   {before / after:5.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the tweet converter against the original implementation.')
+    parser.add_argument('--tweets', type=int, default=100000, help='Number of synthetic tweets (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    args = parser.parse_args()
+    main(args.tweets, args.seed)
@@ -0,0 +1,71 @@
+"""Check that the pipeline modules import quickly and without side effects.
+
+Each module is imported in a fresh interpreter inside an empty directory (no
+secrets.txt, no hash store), timed with -X importtime, and compared to its
+budget. For the stages that need pandas anyway, the pandas import measured
+in the same interpreter is subtracted first, so the budget covers only what
+the module itself adds. Run from the repository root:
+    python -m benchmarks.import_time
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> (budget in ms, whether the pandas import is excluded from the measured time)
+BUDGETS = {
+    'prompts': (50, False),
+    'models': (100, False),
+    'retrieve_json': (150, True),
+    'process_data': (150, True),
+    'classify': (300, True),
+}
+
+
+def import_time(module, repeat=3, exclude=None):
+    """Return the best cumulative import time of module in ms and the files it created.
+
+    The cumulative time of the exclude module, if given, is subtracted.
+    """
+    best = None
+    created = set()
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(os.environ, PYTHONPATH=REPO_DIR)
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                    cwd=workdir, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f'importing {module} failed:\n{result.stderr}')
+            created |= set(os.listdir(workdir))
+        times = {}
+        for line in result.stderr.splitlines():
+            fields = [field.strip() for field in line.split('|')]
+            if len(fields) == 3 and fields[2] in (module, exclude):
+                times[fields[2]] = int(fields[1]) / 1000
+        milliseconds = times.get(module, 0) - times.get(exclude, 0)
+        best = milliseconds if best is None else min(best, milliseconds)
+    return best, sorted(created)
+
+
+def main(repeat):
+    pandas_ms, _ = import_time('pandas', repeat)
+    print(f'{"pandas":<24}{pandas_ms:9.1f} ms  (reference)')
+    failures = 0
+    for module, (budget, on_top_of_pandas) in BUDGETS.items():
+        milliseconds, created = import_time(module, repeat, 'pandas' if on_top_of_pandas else None)
+        ok = milliseconds <= budget and not created
+        failures += not ok
+        label = f'{module} - pandas' if on_top_of_pandas else module
+        note = f' created {created}' if created else ''
+        print(f'{label:<24}{milliseconds:9.1f} ms  budget {budget:5} ms  {"ok" if ok else "OVER"}{note}')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check module import times against their budgets.')
+    parser.add_argument('--repeat', type=int, default=3, help='Imports per module; the fastest counts (default: 3)')
+    args = parser.parse_args()
+    sys.exit(1 if main(args.repeat) else 0)
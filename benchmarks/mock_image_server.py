@@ -0,0 +1,85 @@
+"""Local stand-in for the Twitter image CDN.
+
+Serves a fixed pool of synthetic JPEG photos: /images/<n>.jpg returns photo
+n modulo the pool size, so many distinct URLs share the same content, as
+retweeted and reposted images do. Run from the repository root:
+    python -m benchmarks.mock_image_server --port 8901 --pool 64
+"""
+import io
+import re
+import time
+import random
+import argparse
+import threading
+import numpy as np
+import PIL.Image
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+IMAGE_PATH = re.compile(r'^/images/(\d+)\.jpg$')
+
+
+def synthetic_photos(count, size=(640, 480), seed=0):
+    """Return count distinct JPEG-encoded photo-like images."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    photos = []
+    for _ in range(count):
+        colors = rng.uniform(0, 255, (2, 3))
+        blend = ((x / width + y / height) / 2)[..., None]
+        pixels = colors[0] * (1 - blend) + colors[1] * blend + rng.normal(0, 10, (height, width, 3))
+        buffer = io.BytesIO()
+        PIL.Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=85)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+class MockImageHandler(BaseHTTPRequestHandler):
+    """Serve the synthetic photo pool after a simulated latency."""
+
+    def do_GET(self):
+        server = self.server
+        match = IMAGE_PATH.match(self.path)
+        with server.lock:
+            server.requests += 1
+        if match is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        time.sleep(server.latency * random.uniform(0.5, 1.5))
+        data = server.photos[int(match.group(1)) % len(server.photos)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, pool=64, latency=0.0, size=(640, 480)):
+    """Start the image server in a daemon thread and return it; server.server_port holds the port."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockImageHandler)
+    server.photos = synthetic_photos(pool, size)
+    server.latency = latency
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve synthetic tweet photos over HTTP.')
+    parser.add_argument('--port', type=int, default=8901, help='Port to listen on (default: 8901)')
+    parser.add_argument('--pool', type=int, default=64, help='Number of distinct photos (default: 64)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean simulated response latency in seconds (default: 0)')
+    args = parser.parse_args()
+    server = start_server(args.port, args.pool, args.latency)
+    print(f'Mock image CDN listening on http://127.0.0.1:{server.server_port}/images/<n>.jpg')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,104 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Point models.py at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 to run
+classify.py end to end without API keys or cost:
+    python -m benchmarks.mock_llm_server --port 8900 --latency 0.2
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSE = "{'MMI': 'VI', 'location': 'Ridgecrest, CA', 'reason': 'Mock response.'}"
+TWEET_LINE = re.compile(r'^Tweet (\d+): ', re.MULTILINE)
+
+
+def mock_response(request, drop_rate=0.0):
+    """Answer a batched prompt with one JSON entry per numbered tweet, and any other prompt with RESPONSE.
+
+    Each batch entry is left out with probability drop_rate, to exercise the
+    single-tweet fallback of classify.py.
+    """
+    content = request.get('messages', [{}])[-1].get('content', '')
+    if isinstance(content, list):
+        content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    indices = TWEET_LINE.findall(content)
+    if not indices:
+        return RESPONSE
+    return json.dumps([{'index': int(index), 'MMI': 'VI', 'location': 'Ridgecrest, CA', 'reason': 'Mock response.'}
+                       for index in indices if random.random() >= drop_rate])
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Answer chat completion requests with a fixed MMI judgement after a simulated latency."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            request_number = server.requests
+        if server.fail_every and request_number % server.fail_every == 0:
+            self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}}, {'Retry-After': '0'})
+            return
+        time.sleep(server.latency * random.uniform(0.5, 1.5))
+        request = json.loads(body or b'{}')
+        content = server.respond(request) if server.respond else mock_response(request, server.drop_rate)
+        self.send_json(200, {
+            'id': f'chatcmpl-mock-{request_number}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': len(body) // 4, 'completion_tokens': len(content) // 4,
+                      'total_tokens': (len(body) + len(content)) // 4},
+        })
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=0.0, fail_every=0, respond=None, drop_rate=0.0):
+    """Start the mock server in a daemon thread and return it; server.server_port holds the port.
+
+    respond, if given, maps the parsed request body to the reply content.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockLLMHandler)
+    server.latency = latency
+    server.fail_every = fail_every
+    server.respond = respond
+    server.drop_rate = drop_rate
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a mock OpenAI chat completions endpoint.')
+    parser.add_argument('--port', type=int, default=8900, help='Port to listen on (default: 8900)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Mean simulated response latency in seconds (default: 0.2)')
+    parser.add_argument('--fail-every', type=int, default=0, help='Answer every Nth request with HTTP 429 (default: never)')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Probability of leaving a tweet out of a batched answer (default: 0)')
+    args = parser.parse_args()
+    server = start_server(args.port, args.latency, args.fail_every, drop_rate=args.drop_rate)
+    print(f'Mock LLM listening on http://127.0.0.1:{server.server_port}/v1')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,268 @@
+"""End-to-end benchmark of the pipeline stages on synthetic data.
+
+Generates hourly JSON lines files of synthetic tweets with photos, retweets
+and quotes, serves their images from a local stub CDN and answers model
+calls with the mock LLM server, both in separate processes, then times each
+stage:
+
+    retrieve_json     raw tweets -> converted tables
+    filter_dataset    damage word filter over the converted tweets
+    combine_urls      download and hash the images of every tweet, row by row
+    hash_image_lists  the same in concurrent batches, as process_data.main does
+    classify          text classification of the filtered tweets via run_batch
+
+Throughput (for stages that can be rerun, the best of --repeat samples) and
+tracemalloc peak memory are reported per stage and compared with the stored
+baseline for the same configuration in baselines.json; the exit status is 1
+if a stage regressed beyond the tolerance. Run from the repository root:
+    python -m benchmarks.run_benchmarks --tweets 5000
+    python -m benchmarks.run_benchmarks --tweets 5000 --save-baseline
+"""
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import multiprocessing
+import pandas as pd
+import models
+import classify
+import process_data
+import retrieve_json
+from hash_store import HashStore
+from image_fetch import ImageFetcher
+from table_io import read_table
+from benchmarks import mock_image_server, mock_llm_server
+from benchmarks.bench_retrieve import synthetic_lines
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+EPICENTER = 'Ridgecrest, CA'
+
+
+def serve(start_server, options, ports):
+    """Start a stub server in this process, report its port and serve until terminated."""
+    server = start_server(**options)
+    ports.put(server.server_port)
+    while True:
+        time.sleep(3600)
+
+
+def start_process(start_server, **options):
+    """Run a stub server in its own process, so it does not compete for the GIL, and return (process, port)."""
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    process = context.Process(target=serve, args=(start_server, options, ports), daemon=True)
+    process.start()
+    return process, ports.get(timeout=60)
+
+
+def write_fixture(folder, tweets, files, image_base):
+    """Write tweets synthetic tweets to files hourly JSON lines files in folder."""
+    os.makedirs(folder, exist_ok=True)
+    lines = synthetic_lines(tweets, image_url=lambda number: f'{image_base}/images/{number}.jpg')
+    per_file = -(-tweets // files)
+    for index in range(files):
+        with open(os.path.join(folder, f'2019-07-06-{index:02d}.json'), 'wb') as f:
+            f.writelines(line + b'\n' for line in lines[index * per_file:(index + 1) * per_file])
+
+
+def load_converted(folder):
+    """Return the converted tweets of a folder without retweets, as process_data.load_file reads them."""
+    df = pd.concat([read_table(os.path.join(folder, file)) for file in sorted(os.listdir(folder)) if file.endswith('.json')],
+                   ignore_index=True)
+    df['text'] = df['text'].astype(str)
+    return df[~df['text'].str.startswith('RT @')]
+
+
+def prepare_retrieve(config, workdir):
+    def run():
+        retrieve_json.main(os.path.join(workdir, 'raw'), os.path.join(workdir, 'converted'), force=True)
+        return config.tweets
+    return run
+
+
+def prepare_filter(config, workdir):
+    df = load_converted(os.path.join(workdir, 'converted'))
+    def run():
+        process_data.filter_dataset(df, 'english', terms_column='damage_terms')
+        return len(df)
+    return run
+
+
+def image_rows(config, workdir):
+    """Return the converted tweets with images and reset the per-run image state of process_data."""
+    df = load_converted(os.path.join(workdir, 'converted'))
+    df = df[[bool(process_data.get_image_urls(row)) for _, row in df.iterrows()]]
+    process_data.clear_url_memo()
+    process_data.fetcher = ImageFetcher(concurrency=config.concurrency)
+    return df
+
+
+def prepare_combine(config, workdir):
+    df = image_rows(config, workdir)
+    path = os.path.join(workdir, f'seen_hashes_{time.monotonic_ns()}.sqlite')
+    def run():
+        seen_hashes = HashStore(path)
+        results = [process_data.combine_urls(row, seen_hashes) for _, row in df.iterrows()]
+        seen_hashes.close()
+        return sum(len(image_urls) for image_urls, _, _ in results)
+    return run
+
+
+def prepare_hash_lists(config, workdir):
+    df = image_rows(config, workdir)
+    image_url_lists = [process_data.get_image_urls(row) for _, row in df.iterrows()]
+    def run():
+        process_data.hash_image_lists(image_url_lists, process_data.fetcher)
+        return sum(len(image_urls) for image_urls in image_url_lists)
+    return run
+
+
+def prepare_classify(config, workdir):
+    df = process_data.filter_dataset(load_converted(os.path.join(workdir, 'converted')), 'english')
+    rows = [{'id': int(tweet_id), 'text': text} for tweet_id, text in zip(df['id'], df['text'])][:config.classify]
+    output_path = os.path.join(workdir, f'results_{time.monotonic_ns()}.jsonl')
+    def run():
+        count, _ = classify.run_batch(rows, 'gpt4', 'text', EPICENTER, output_path, config.concurrency,
+                                      batch_size=config.batch_size)
+        return count
+    return run
+
+
+STAGES = {'retrieve_json': prepare_retrieve, 'filter_dataset': prepare_filter, 'combine_urls': prepare_combine,
+          'hash_image_lists': prepare_hash_lists, 'classify': prepare_classify}
+# Stages that give the same work when rerun; the others warm a memo, cache or results log.
+REPEATABLE = {'retrieve_json', 'filter_dataset'}
+MIN_SAMPLE_SECONDS = 0.5
+
+
+def measure(run, memory=False):
+    """Run a stage and return its item count, wall time in seconds and peak traced memory in bytes."""
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    items = run()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return items, seconds, peak
+
+
+def measure_repeated(run, repeat):
+    """Return the item count and the best mean seconds per run over repeat samples of at least MIN_SAMPLE_SECONDS."""
+    best = None
+    for _ in range(repeat):
+        runs = 0
+        start = time.perf_counter()
+        while True:
+            items = run()
+            runs += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= MIN_SAMPLE_SECONDS:
+                break
+        best = elapsed / runs if best is None else min(best, elapsed / runs)
+    return items, best
+
+
+def config_key(config):
+    """Return the baselines.json key of a benchmark configuration."""
+    return (f'tweets={config.tweets},files={config.files},pool={config.pool},classify={config.classify},'
+            f'batch_size={config.batch_size},concurrency={config.concurrency},'
+            f'image_latency={config.image_latency},llm_latency={config.llm_latency}')
+
+
+def compare(results, baseline, tolerance):
+    """Return the stages whose throughput dropped or whose peak memory grew beyond tolerance."""
+    regressions = []
+    for stage, result in results.items():
+        reference = baseline.get(stage)
+        if reference is None:
+            continue
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append(f"{stage}: {result['throughput']:,.0f}/s vs baseline {reference['throughput']:,.0f}/s")
+        if result.get('peak_mb') and reference.get('peak_mb') and result['peak_mb'] > reference['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{stage}: peak {result['peak_mb']:.1f} MB vs baseline {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(config):
+    image_server, image_port = start_process(mock_image_server.start_server, pool=config.pool, latency=config.image_latency)
+    llm_server, llm_port = start_process(mock_llm_server.start_server, latency=config.llm_latency)
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{llm_port}/v1'
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            with open(models.SECRET_FILE, 'w') as f:
+                f.write('openai_key, benchmark\ngemini_key, benchmark\n')
+            write_fixture(os.path.join(workdir, 'raw'), config.tweets, config.files,
+                          f'http://127.0.0.1:{image_port}')
+            if config.stages and 'retrieve_json' not in config.stages:
+                prepare_retrieve(config, workdir)()
+            results = {}
+            for stage, prepare in STAGES.items():
+                if config.stages and stage not in config.stages:
+                    continue
+                if stage in REPEATABLE:
+                    items, seconds = measure_repeated(prepare(config, workdir), config.repeat)
+                else:
+                    items, seconds, _ = measure(prepare(config, workdir))
+                peak = None
+                if config.memory:
+                    _, _, peak = measure(prepare(config, workdir), memory=True)
+                results[stage] = {'items': items, 'seconds': round(seconds, 3), 'throughput': round(items / seconds, 1),
+                                  'peak_mb': round(peak / 1024 ** 2, 1) if peak is not None else None}
+                peak_text = f"{results[stage]['peak_mb']:8.1f} MB" if peak is not None else ''
+                print(f'{stage:<16}{items:>9} items {seconds:8.2f} s {items / seconds:12,.0f} items/s {peak_text}')
+        finally:
+            os.chdir(cwd)
+            image_server.terminate()
+            llm_server.terminate()
+
+    baselines = {}
+    if os.path.exists(BASELINES_FILE):
+        with open(BASELINES_FILE) as f:
+            baselines = json.load(f)
+    key = config_key(config)
+    if config.save_baseline:
+        baselines[key] = {'python': platform.python_version(), 'machine': platform.machine(),
+                          'processor_count': os.cpu_count(), 'recorded': time.strftime('%Y-%m-%d'), 'stages': results}
+        with open(BASELINES_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline saved for {key}')
+        return 0
+    if key not in baselines:
+        print(f'No baseline for {key}; rerun with --save-baseline to record one')
+        return 0
+    regressions = compare(results, baselines[key]['stages'], config.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if not regressions:
+        print(f'No regressions against the baseline recorded on {baselines[key]["recorded"]}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic tweets, images and model responses.')
+    parser.add_argument('--tweets', type=int, default=5000, help='Number of synthetic tweets (default: 5000)')
+    parser.add_argument('--files', type=int, default=4, help='Number of hourly files the tweets are split into (default: 4)')
+    parser.add_argument('--pool', type=int, default=64, help='Number of distinct images behind the image URLs (default: 64)')
+    parser.add_argument('--classify', type=int, default=200, help='Number of filtered tweets to classify (default: 200)')
+    parser.add_argument('--batch-size', type=int, default=1, help='Tweets per classification request (default: 1)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent image downloads and model requests (default: 16)')
+    parser.add_argument('--image-latency', type=float, default=0.01, help='Mean latency of the image stub in seconds (default: 0.01)')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='Mean latency of the mock LLM in seconds (default: 0.05)')
+    parser.add_argument('--stages', nargs='*', choices=sorted(STAGES), default=None, help='Stages to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing samples of the stages that can be rerun; the fastest counts (default: 3)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Skip the tracemalloc pass that measures peak memory')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed throughput drop or memory growth before a stage counts as regressed (default: 0.25)')
+    parser.add_argument('--save-baseline', action='store_true', help='Record the results as the baseline of this configuration')
+    sys.exit(main(parser.parse_args()))
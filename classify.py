@@ -0,0 +1,409 @@
+import os
+import ast
+import json
+import time
+import argparse
+import threading
+import models
+import metrics
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from models import RESPONSE_TOKENS, call_model
+from prompts import create_text_prompt, create_text_batch_prompt, create_image_prompt
+from table_io import is_missing, read_table
+from image_cache import CACHE_DIR
+from image_fetch import ImageFetcher
+from image_preprocess import ImagePreprocessor, MAX_EDGE, QUALITY, FORMATS
+from response_cache import RESPONSE_CACHE_FILE, ResponseCache
+from job_log import ResultsLog
+from geo_index import GeoTimeIndex, MAX_DISTANCE_KM, MAX_HOURS, load_filtered, parse_point, parse_time
+from retrieve_json import iter_chunks
+
+# Completion tokens allowed per tweet of a batched request: an {index, MMI,
+# location, reason} entry with a two-sentence reason takes about 45-60.
+BATCH_ENTRY_TOKENS = 80
+MAX_RESPONSE_TOKENS = 16384
+
+
+class RateLimiter:
+    """Token-bucket limiter on requests per minute and tokens per minute.
+
+    A limit of None disables that bucket. acquire() blocks until both buckets
+    hold enough budget for the request.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.capacity = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+        self.level = {key: capacity for key, capacity in self.capacity.items() if capacity}
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        """Add the budget accumulated since the last refill."""
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        for key in self.level:
+            self.level[key] = min(self.capacity[key], self.level[key] + self.capacity[key] * elapsed / 60)
+
+    def acquire(self, tokens=0):
+        """Block until one request using the given number of tokens may be sent."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.refill()
+                need = {'requests': 1, 'tokens': tokens}
+                need = {key: min(need[key], self.capacity[key]) for key in self.level}
+                waits = [(need[key] - self.level[key]) * 60 / self.capacity[key] for key in self.level if self.level[key] < need[key]]
+                if not waits:
+                    for key in self.level:
+                        self.level[key] -= need[key]
+                    metrics.observe('rate_limit_wait_seconds', waited, stage='classify')
+                    return
+                delay = max(waits)
+            time.sleep(delay)
+            waited += delay
+
+
+def batch_response_tokens(count):
+    """Return the completion token limit of a batched request for count tweets."""
+    return min(max(RESPONSE_TOKENS, count * BATCH_ENTRY_TOKENS), MAX_RESPONSE_TOKENS)
+
+
+def estimate_tokens(prompt, response_tokens=RESPONSE_TOKENS):
+    """Estimate the tokens a request counts against the limit: about 4 characters per prompt token plus the response budget."""
+    return len(prompt) // 4 + response_tokens
+
+
+def list_inputs(folder, input):
+    """Return the sorted _text or _image output files of process_data in folder."""
+    suffixes = (f'_{input}.json', f'_{input}.parquet')
+    return sorted(file for file in os.listdir(folder) if file.endswith(suffixes))
+
+
+def input_columns(input):
+    """Return the columns that may hold what is classified for an input type, the preferred one first.
+
+    Images deduplicated with --perceptual-hash are classified from
+    near_unique_image_urls, so near duplicates are not sent to the model.
+    """
+    return ['text'] if input == 'text' else ['near_unique_image_urls', 'unique_image_urls']
+
+
+def to_rows(df, input):
+    """Yield a dict with the id and the text or first unique image URL of every tweet of df to classify."""
+    columns = [df[column] for column in input_columns(input) if column in df]
+    for tweet_id, *values in zip(df['id'], *columns):
+        value = next((value for value in values if not is_missing(value)), None)
+        if input == 'text':
+            yield {'id': int(tweet_id), 'text': value}
+        elif value is not None and len(value) > 0:
+            yield {'id': int(tweet_id), 'image_url': value[0]}
+
+
+def iter_rows(folder, input):
+    """Yield the rows to classify file by file, in file order."""
+    for file in list_inputs(folder, input):
+        df = read_table(os.path.join(folder, file), columns=['id', *input_columns(input)], lines=True)
+        if len(df) == 0:
+            continue
+        yield from to_rows(df, input)
+
+
+def prioritized_rows(folder, input, epicenter_coords=None, event_time=None, max_distance_km=MAX_DISTANCE_KM, max_hours=MAX_HOURS):
+    """Yield the rows to classify closest to the epicenter and earliest after the event first.
+
+    Unlike iter_rows, every input file is read up front to build the
+    GeoTimeIndex that orders them.
+    """
+    df = load_filtered(folder, input, columns=['id', *input_columns(input), 'time', 'place', 'latitude', 'longitude'])
+    if len(df) == 0:
+        return
+    index = GeoTimeIndex(df, epicenter_coords, event_time)
+    if epicenter_coords is not None:
+        located = int((index.distance_km <= max_distance_km).sum())
+        print(f'Prioritizing {len(index)} tweets, {located} located within {max_distance_km:g} km of the epicenter')
+    else:
+        print(f'Prioritizing {len(index)} tweets by time since {index.event_time}')
+    yield from to_rows(df.iloc[index.priority_order(max_distance_km, max_hours)], input)
+
+
+def classify_row(row, model, input, epicenter, limiter=None, fetcher=None, cache=None):
+    """Classify one tweet with call_model and return a result record.
+
+    Cached responses are returned without consuming rate limit budget.
+    """
+    result = {'id': row['id'], 'model': model, 'input': input, 'response': None, 'error': None}
+    image = None
+    if input == 'text':
+        prompt = create_text_prompt(epicenter, row['text'])
+    else:
+        prompt = create_image_prompt(epicenter)
+        result['image_url'] = row['image_url']
+        image = fetcher.path(row['image_url'])
+        if image is None:
+            result['error'] = 'image not available'
+            return result
+    if cache is not None:
+        key, result['response'] = cache.lookup(model, input, prompt, image, models.image_preprocessor.settings())
+        if result['response'] is not None:
+            result['cached'] = True
+            return result
+    if limiter is not None:
+        limiter.acquire(estimate_tokens(prompt))
+    start = time.perf_counter()
+    try:
+        result['response'] = call_model(model, input, prompt, image)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    if cache is not None and result['response'] is not None:
+        cache.put(key, model, input, result['response'])
+    result['latency'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def parse_literal(text):
+    """Parse a JSON or Python literal, returning None if it is neither."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        try:
+            return ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            return None
+
+
+def complete_objects(text):
+    """Return the complete top-level {...} objects of an array text whose end may be cut off."""
+    objects = []
+    depth = 0
+    quote = None
+    escaped = False
+    start = None
+    for position, char in enumerate(text):
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                start = position
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                objects.append(text[start:position + 1])
+    return objects
+
+
+def parse_batch_response(response, count):
+    """Parse the JSON array answering a batched prompt into {index: answer}.
+
+    Malformed, duplicate and out-of-range entries are dropped, so the caller
+    can tell which tweets are missing an answer. If the array is cut off,
+    e.g. at the completion token limit, the entries that arrived whole are
+    kept.
+    """
+    if not response:
+        return {}
+    start, end = response.find('['), response.rfind(']')
+    if start == -1:
+        return {}
+    entries = parse_literal(response[start:end + 1]) if end > start else None
+    if not isinstance(entries, list):
+        entries = [parse_literal(text) for text in complete_objects(response[start + 1:])]
+    answers = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or 'MMI' not in entry:
+            continue
+        try:
+            index = int(entry['index'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < count and index not in answers:
+            answers[index] = {key: value for key, value in entry.items() if key != 'index'}
+    return answers
+
+
+def classify_text_batch(rows, model, epicenter, limiter=None, cache=None):
+    """Classify several tweets with one batched prompt and return one result record per row.
+
+    Rows with a cached single-tweet response are answered from the cache and
+    only the others are batched; each answer is cached under its row's
+    single-tweet key. Rows whose answer is missing or malformed are
+    classified again with a single-tweet prompt and marked with fallback=True.
+    """
+    results = [None] * len(rows)
+    keys = {}
+    if cache is not None:
+        for index, row in enumerate(rows):
+            keys[index], response = cache.lookup(model, 'text', create_text_prompt(epicenter, row['text']))
+            if response is not None:
+                results[index] = {'id': row['id'], 'model': model, 'input': 'text', 'response': response, 'error': None,
+                                  'cached': True}
+    pending = [index for index, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+    prompt = create_text_batch_prompt(epicenter, [rows[index]['text'] for index in pending])
+    response = None
+    error = None
+    response_tokens = batch_response_tokens(len(pending))
+    if limiter is not None:
+        limiter.acquire(estimate_tokens(prompt, response_tokens))
+    start = time.perf_counter()
+    try:
+        response = call_model(model, 'text', prompt, max_tokens=response_tokens)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    latency = round(time.perf_counter() - start, 3)
+    answers = parse_batch_response(response, len(pending))
+    for position, index in enumerate(pending):
+        row = rows[index]
+        if position in answers:
+            answer = str(answers[position])
+            if cache is not None:
+                cache.put(keys[index], model, 'text', answer)
+            results[index] = {'id': row['id'], 'model': model, 'input': 'text', 'response': answer, 'error': None,
+                              'batch_size': len(pending), 'latency': latency}
+            continue
+        result = classify_row(row, model, 'text', epicenter, limiter, None, cache)
+        result['fallback'] = True
+        if result['error'] is None and error is not None:
+            result['batch_error'] = error
+        results[index] = result
+    return results
+
+
+def error_records(rows, model, input, error):
+    """Return a result record with the error for each row of a task that raised instead of returning results."""
+    records = []
+    for row in rows:
+        record = {'id': row['id'], 'model': model, 'input': input, 'response': None, 'error': f'{type(error).__name__}: {error}'}
+        if 'image_url' in row:
+            record['image_url'] = row['image_url']
+        records.append(record)
+    return records
+
+
+def run_batch(rows, model, input, epicenter, output_path, concurrency=8, limiter=None, fetcher=None, cache=None, batch_size=1,
+              budget=None):
+    """Classify rows concurrently and append one JSON line per result to the results log at output_path.
+
+    Rows whose id already has a response in the log are skipped, so an
+    interrupted run resumes where it stopped. With batch_size > 1, text rows
+    are sent batch_size at a time in one prompt. At most concurrency requests
+    are in flight or queued at any time, so rows are read lazily and memory
+    stays bounded. With a budget, only the first budget rows not yet done are
+    classified in this run. Returns the numbers of classified and skipped rows.
+    """
+    log = ResultsLog(output_path)
+    in_flight = threading.BoundedSemaphore(concurrency)
+    count_lock = threading.Lock()
+    count = 0
+    skipped = 0
+
+    def pending_rows():
+        nonlocal skipped
+        sent = 0
+        for row in rows:
+            if log.is_completed(row['id']):
+                skipped += 1
+            elif budget is not None and sent >= budget:
+                return
+            else:
+                sent += 1
+                yield row
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            def write_results(task_rows, future):
+                nonlocal count
+                try:
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        # An exception raised in a done callback is only logged, so record it as failed rows instead.
+                        results = error_records(task_rows if isinstance(task_rows, list) else [task_rows], model, input, e)
+                    results = results if isinstance(results, list) else [results]
+                    for result in results:
+                        log.append(result)
+                        outcome = 'error' if result['error'] is not None else 'cached' if result.get('cached') else 'ok'
+                        metrics.inc('tweets_classified', stage='classify', outcome=outcome)
+                        if result.get('fallback'):
+                            metrics.inc('batch_fallbacks', stage='classify')
+                    with count_lock:
+                        count += len(results)
+                finally:
+                    in_flight.release()
+
+            if batch_size > 1 and input == 'text':
+                tasks = ((classify_text_batch, batch, model, epicenter, limiter, cache)
+                         for batch in iter_chunks(pending_rows(), batch_size))
+            else:
+                tasks = ((classify_row, row, model, input, epicenter, limiter, fetcher, cache)
+                         for row in pending_rows())
+            for task in tasks:
+                in_flight.acquire()
+                future = executor.submit(*task)
+                future.add_done_callback(partial(write_results, task[1]))
+    finally:
+        log.close()
+    metrics.inc('tweets_skipped', skipped, stage='classify')
+    return count, skipped
+
+
+def main(folder, model, input, epicenter, output_path, concurrency=8, requests_per_minute=None, tokens_per_minute=None,
+         cache_path=RESPONSE_CACHE_FILE, batch_size=1, max_edge=MAX_EDGE, image_format='jpeg', quality=QUALITY,
+         epicenter_coords=None, event_time=None, budget=None, max_distance_km=MAX_DISTANCE_KM, max_hours=MAX_HOURS):
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    models.image_preprocessor = ImagePreprocessor(max_edge, image_format, quality, cache_dir=CACHE_DIR)
+    fetcher = ImageFetcher(cache_dir=CACHE_DIR) if input == 'image' else None
+    cache = ResponseCache(cache_path) if cache_path else None
+    if epicenter_coords is not None or event_time is not None:
+        rows = prioritized_rows(folder, input, epicenter_coords, event_time, max_distance_km, max_hours)
+    else:
+        rows = iter_rows(folder, input)
+    start = time.perf_counter()
+    with metrics.stage('classify'):
+        count, skipped = run_batch(rows, model, input, epicenter, output_path, concurrency, limiter, fetcher, cache, batch_size,
+                                   budget)
+    print(f'{count} tweets classified in {time.perf_counter() - start:.1f} s ({skipped} already done), saved to {output_path}')
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['entries']} entries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify the filtered tweets of a folder with an LLM.")
+    parser.add_argument("folder", type=str, help="Folder with the _text and _image files written by process_data.")
+    parser.add_argument("--model", type=str, default="gpt4", choices=["gpt4", "gemini"], help="Model to call (default: gpt4)")
+    parser.add_argument("--input", type=str, default="text", choices=["text", "image"], help="Classify tweet texts or images (default: text)")
+    parser.add_argument("--epicenter", type=str, required=True, help="Epicenter put into the prompts, e.g. 'Ridgecrest, CA'")
+    parser.add_argument("--output", type=str, default=None, help="Append-only JSON lines results log; rerunning with the same log resumes the job (default: <folder>_<model>_<input>.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight (default: 8)")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute limit (default: unlimited)")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute limit (default: unlimited)")
+    parser.add_argument("--response-cache", type=str, default=RESPONSE_CACHE_FILE, help=f"Response cache database (default: {RESPONSE_CACHE_FILE})")
+    parser.add_argument("--no-response-cache", action="store_true", help="Always call the model, bypassing the response cache")
+    parser.add_argument("--batch-size", type=int, default=1, help="Tweets per text request; answers missing from a batch fall back to single-tweet calls (default: 1)")
+    parser.add_argument("--max-image-edge", type=int, default=MAX_EDGE, help=f"Downscale images so their longest edge is at most this many pixels, 0 to keep the size (default: {MAX_EDGE})")
+    parser.add_argument("--image-format", type=str, default="jpeg", choices=sorted(FORMATS), help="Format images are re-encoded to before upload (default: jpeg)")
+    parser.add_argument("--image-quality", type=int, default=QUALITY, help=f"Encoder quality of re-encoded images (default: {QUALITY})")
+    parser.add_argument("--epicenter-coords", type=parse_point, default=None, metavar="LAT,LON", help="Classify tweets closest to these epicenter coordinates first (default: file order)")
+    parser.add_argument("--event-time", type=parse_time, default=None, help="Classify tweets posted soonest after this ISO 8601 time first, UTC unless an offset is given (default: file order, or the earliest tweet with --epicenter-coords)")
+    parser.add_argument("--max-distance", type=float, default=MAX_DISTANCE_KM, help=f"Distance in km beyond which tweets get no priority for being close (default: {MAX_DISTANCE_KM})")
+    parser.add_argument("--max-hours", type=float, default=MAX_HOURS, help=f"Hours after the event beyond which tweets get no priority for being early (default: {MAX_HOURS})")
+    parser.add_argument("--budget", type=int, default=None, help="Classify at most this many tweets not yet done in this run (default: all)")
+    parser.add_argument("--metrics-out", type=str, default=None, help="Write timers and counters to this file, in Prometheus format if it ends with .prom and as JSON otherwise")
+    args = parser.parse_args()
+    output_path = args.output or f'{args.folder.rstrip(os.sep)}_{args.model}_{args.input}.jsonl'
+    main(args.folder, args.model, args.input, args.epicenter, output_path, args.concurrency, args.rpm, args.tpm,
+         None if args.no_response_cache else args.response_cache, args.batch_size, args.max_image_edge, args.image_format,
+         args.image_quality, args.epicenter_coords, args.event_time, args.budget, args.max_distance, args.max_hours)
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
@@ -0,0 +1,10 @@
+import hashlib
+
+
+def file_digest(filepath):
+    """Return the SHA-256 digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
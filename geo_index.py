@@ -0,0 +1,205 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from table_io import read_table, to_timestamps
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+PRECISION = 4  # cells of about 39 x 20 km
+BUCKET_MINUTES = 60
+MAX_DISTANCE_KM = 300
+MAX_HOURS = 72
+
+
+def geohash(latitude, longitude, precision=PRECISION):
+    """Return the geohash of a point as a string of precision base-32 characters."""
+    intervals = [[-180.0, 180.0], [-90.0, 90.0]]
+    values = [longitude, latitude]
+    chars = []
+    bits = 0
+    for bit in range(precision * 5):
+        interval = intervals[bit % 2]
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if values[bit % 2] >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        if bit % 5 == 4:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+    return ''.join(chars)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Return the great-circle distance in km between points given in degrees; arguments may be arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def parse_point(text):
+    """Parse 'latitude,longitude' into a tuple of floats, for use as an argparse type."""
+    try:
+        latitude, longitude = (float(value) for value in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected 'latitude,longitude', got {text!r}")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise argparse.ArgumentTypeError(f'coordinates out of range: {text!r}')
+    return latitude, longitude
+
+
+def parse_time(text):
+    """Parse an ISO 8601 time into a UTC timestamp, assuming UTC if it has no offset."""
+    timestamp = pd.Timestamp(text)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+
+def place_centroid(place):
+    """Return the (latitude, longitude) centre of the bounding box of a Twitter place, or None.
+
+    The place may be a dict or the JSON string Parquet outputs hold.
+    """
+    if isinstance(place, str):
+        if not place.startswith('{'):
+            return None
+        try:
+            place = json.loads(place)
+        except ValueError:
+            return None
+    if not isinstance(place, dict):
+        return None
+    try:
+        corners = np.asarray(place['bounding_box']['coordinates'][0], dtype=float)
+    except (KeyError, TypeError, IndexError, ValueError):
+        return None
+    if corners.ndim != 2 or corners.shape[1] != 2 or len(corners) == 0:
+        return None
+    longitude, latitude = corners.mean(axis=0)
+    return latitude, longitude
+
+
+def tweet_locations(df):
+    """Return latitude and longitude arrays for the tweets of a DataFrame, NaN where unknown.
+
+    Exact coordinates are used where a tweet has them, otherwise the centre of
+    its place's bounding box.
+    """
+    def column(name):
+        if name not in df:
+            return np.full(len(df), np.nan)
+        return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float, na_value=np.nan, copy=True)
+
+    latitude, longitude = column('latitude'), column('longitude')
+    if 'place' in df:
+        for index in np.flatnonzero(np.isnan(latitude) | np.isnan(longitude)):
+            centre = place_centroid(df['place'].iat[index])
+            if centre is not None:
+                latitude[index], longitude[index] = centre
+    return latitude, longitude
+
+
+def tweet_times(df):
+    """Return the times of the tweets of a DataFrame as UTC timestamps, NaT where unknown.
+
+    Accepts Twitter time strings, parsed times and the epoch milliseconds the
+    JSON outputs of process_data hold.
+    """
+    times = df['time'] if 'time' in df else pd.Series([None] * len(df), index=df.index, dtype=object)
+    if pd.api.types.is_numeric_dtype(times):
+        return pd.to_datetime(times, unit='ms', errors='coerce', utc=True)
+    return to_timestamps(times)
+
+
+class GeoTimeIndex:
+    """Spatial-temporal index of tweets by geohash cell and time bucket.
+
+    Each tweet is keyed by the geohash of its location and the start of the
+    time bucket it was posted in; tweets without a location have the cell
+    None. Given an epicenter and an event time, it also holds each tweet's
+    distance from the epicenter and hours since the event, and orders the
+    tweets so the closest and earliest come first. Rows are referred to by
+    their position in the DataFrame the index was built from.
+    """
+
+    def __init__(self, df, epicenter=None, event_time=None, precision=PRECISION, bucket_minutes=BUCKET_MINUTES):
+        self.precision = precision
+        self.bucket_minutes = bucket_minutes
+        self.latitude, self.longitude = tweet_locations(df)
+        times = tweet_times(df).reset_index(drop=True)
+        self.times = times
+        self.cells = [None if np.isnan(latitude) or np.isnan(longitude) else geohash(latitude, longitude, precision)
+                      for latitude, longitude in zip(self.latitude, self.longitude)]
+        self.buckets = times.dt.floor(f'{bucket_minutes}min')
+        self.epicenter = epicenter
+        self.event_time = event_time if event_time is not None else times.min()
+        if epicenter is not None:
+            self.distance_km = haversine_km(self.latitude, self.longitude, *epicenter)
+        else:
+            self.distance_km = np.full(len(df), np.nan)
+        self.hours = ((times - self.event_time).dt.total_seconds() / 3600).to_numpy(dtype=float, na_value=np.nan)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def counts(self):
+        """Return the number of located tweets and their median distance from the epicenter per cell and time bucket."""
+        df = pd.DataFrame({'cell': self.cells, 'bucket': self.buckets, 'distance_km': self.distance_km})
+        counts = df.groupby(['cell', 'bucket']).agg(tweets=('cell', 'size'), distance_km=('distance_km', 'median'))
+        return counts.reset_index().sort_values(['tweets', 'bucket'], ascending=[False, True], ignore_index=True)
+
+    def query(self, radius_km=None, start=None, end=None):
+        """Return the positions of the tweets within radius_km of the epicenter and posted in [start, end)."""
+        mask = np.ones(len(self), dtype=bool)
+        if radius_km is not None:
+            mask &= self.distance_km <= radius_km
+        if start is not None:
+            mask &= (self.times >= start).to_numpy()
+        if end is not None:
+            mask &= (self.times < end).to_numpy()
+        return np.flatnonzero(mask)
+
+    def priority_scores(self, max_distance_km=MAX_DISTANCE_KM, max_hours=MAX_HOURS):
+        """Return a score per tweet, lower first: distance and time since the event, each scaled to [0, 1].
+
+        Tweets without a location, or posted before the event or without a
+        time, get the maximum of that part of the score.
+        """
+        distance = np.where(np.isnan(self.distance_km), 1.0, np.minimum(self.distance_km / max_distance_km, 1.0))
+        hours = np.where(np.isnan(self.hours) | (self.hours < 0), 1.0, np.minimum(self.hours / max_hours, 1.0))
+        return distance + hours
+
+    def priority_order(self, max_distance_km=MAX_DISTANCE_KM, max_hours=MAX_HOURS):
+        """Return the positions of the tweets by priority score, ties broken by time and then position."""
+        scores = self.priority_scores(max_distance_km, max_hours)
+        hours = np.where(np.isnan(self.hours), np.inf, self.hours)
+        return np.lexsort((np.arange(len(self)), hours, scores))
+
+
+def load_filtered(folder, input='text', columns=None):
+    """Return the _text or _image outputs of process_data in folder as one DataFrame."""
+    suffixes = (f'_{input}.json', f'_{input}.parquet')
+    frames = [read_table(os.path.join(folder, file), columns=columns, lines=True)
+              for file in sorted(os.listdir(folder)) if file.endswith(suffixes)]
+    frames = [df for df in frames if len(df)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the filtered tweets of a folder by geohash cell and time bucket.")
+    parser.add_argument("folder", type=str, help="Folder with the _text and _image files written by process_data.")
+    parser.add_argument("--input", type=str, default="text", choices=["text", "image"], help="Index the _text or _image files (default: text)")
+    parser.add_argument("--epicenter-coords", type=parse_point, default=None, metavar="LAT,LON", help="Epicenter to measure distances from (default: none)")
+    parser.add_argument("--event-time", type=parse_time, default=None, help="Time of the event, ISO 8601, UTC unless an offset is given (default: earliest tweet)")
+    parser.add_argument("--precision", type=int, default=PRECISION, help=f"Geohash characters per cell (default: {PRECISION})")
+    parser.add_argument("--bucket-minutes", type=int, default=BUCKET_MINUTES, help=f"Length of the time buckets in minutes (default: {BUCKET_MINUTES})")
+    parser.add_argument("--top", type=int, default=20, help="Number of busiest cells and buckets to print (default: 20)")
+    args = parser.parse_args()
+    df = load_filtered(args.folder, args.input, columns=['id', 'time', 'place', 'latitude', 'longitude'])
+    index = GeoTimeIndex(df, args.epicenter_coords, args.event_time, args.precision, args.bucket_minutes)
+    located = int(np.sum(~np.isnan(index.latitude)))
+    print(f'{len(index)} tweets, {located} with a location, event time {index.event_time}')
+    print(index.counts().head(args.top).to_string(index=False))
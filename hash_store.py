@@ -0,0 +1,62 @@
+import os
+import pickle
+import sqlite3
+
+
+class HashStore:
+    """Set-like store of seen image hashes backed by an indexed SQLite table.
+
+    Membership checks are index lookups, so the hashes are never loaded into
+    memory, and commit() only writes the hashes added since the last commit.
+    The database runs in WAL mode, so several worker processes can open it
+    at once.
+    """
+
+    def __init__(self, path, legacy_pickle=None):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS hashes (hash TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS phashes (algorithm TEXT, hash TEXT, PRIMARY KEY (algorithm, hash)) WITHOUT ROWID')
+        self.conn.commit()
+        if legacy_pickle and os.path.exists(legacy_pickle) and len(self) == 0:
+            self.import_pickle(legacy_pickle)
+
+    def __contains__(self, hash_value):
+        return self.conn.execute('SELECT 1 FROM hashes WHERE hash = ?', (hash_value,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+
+    def add(self, hash_value):
+        """Add a hash and return True if it was not in the store yet."""
+        cursor = self.conn.execute('INSERT OR IGNORE INTO hashes (hash) VALUES (?)', (hash_value,))
+        return cursor.rowcount == 1
+
+    def update(self, hash_values):
+        """Add many hashes at once."""
+        self.conn.executemany('INSERT OR IGNORE INTO hashes (hash) VALUES (?)', ((h,) for h in hash_values))
+
+    def add_phash(self, algorithm, hash_value):
+        """Record a perceptual hash computed with the given algorithm."""
+        self.conn.execute('INSERT OR IGNORE INTO phashes (algorithm, hash) VALUES (?, ?)', (algorithm, hash_value))
+
+    def phashes(self, algorithm):
+        """Yield the stored perceptual hashes of the given algorithm."""
+        for (hash_value,) in self.conn.execute('SELECT hash FROM phashes WHERE algorithm = ?', (algorithm,)):
+            yield hash_value
+
+    def import_pickle(self, filepath):
+        """Import the hashes of a pickled set, as written by earlier versions of process_data."""
+        with open(filepath, 'rb') as f:
+            self.update(pickle.load(f))
+        self.commit()
+
+    def commit(self):
+        """Persist the hashes added since the last commit."""
+        self.conn.commit()
+
+    def close(self):
+        """Commit pending hashes and close the database."""
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+CACHE_DIR = 'image_cache'
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+class ImageCache:
+    """Content-addressed on-disk store of downloaded images with LRU eviction.
+
+    Image bytes are stored once per SHA-256 digest under root/blobs, and an
+    SQLite index maps each URL to its digest so the same image reached through
+    several URLs is only kept once. The total size of the blobs is kept up to
+    date by triggers, so checking it after an insert does not scan the index.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS urls_digest ON urls (digest)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)')
+        self.conn.execute('INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM blobs')
+        self.conn.execute('CREATE TRIGGER IF NOT EXISTS blobs_insert AFTER INSERT ON blobs '
+                          'BEGIN UPDATE totals SET bytes = bytes + NEW.size WHERE id = 0; END')
+        self.conn.execute('CREATE TRIGGER IF NOT EXISTS blobs_delete AFTER DELETE ON blobs '
+                          'BEGIN UPDATE totals SET bytes = bytes - OLD.size WHERE id = 0; END')
+        self.conn.execute('CREATE TRIGGER IF NOT EXISTS blobs_update AFTER UPDATE OF size ON blobs '
+                          'BEGIN UPDATE totals SET bytes = bytes + NEW.size - OLD.size WHERE id = 0; END')
+        self.conn.commit()
+
+    def blob_path(self, digest):
+        """Return the file path of the blob with the given digest."""
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def digest(self, url):
+        """Return the content digest cached for url, or None."""
+        with self.lock:
+            row = self.conn.execute('SELECT digest FROM urls WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def path(self, url):
+        """Return the local file path of the cached image for url, or None if it is not cached."""
+        digest = self.digest(url)
+        if digest is None or not os.path.exists(self.blob_path(digest)):
+            return None
+        with self.lock:
+            self.conn.execute('UPDATE blobs SET last_access = ? WHERE digest = ?', (time.time(), digest))
+            self.conn.commit()
+        return self.blob_path(digest)
+
+    def get(self, url):
+        """Return the cached bytes for url, or None if it is not cached."""
+        path = self.path(url)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, content):
+        """Store the bytes downloaded from url and return their local file path."""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO urls (url, digest) VALUES (?, ?)', (url, digest))
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger.
+            self.conn.execute('INSERT INTO blobs (digest, size, last_access) VALUES (?, ?, ?) ON CONFLICT (digest) '
+                              'DO UPDATE SET size = excluded.size, last_access = excluded.last_access',
+                              (digest, len(content), time.time()))
+            self.conn.commit()
+        self.evict()
+        return path
+
+    def size(self):
+        """Return the total size in bytes of the cached images."""
+        with self.lock:
+            return self.conn.execute('SELECT bytes FROM totals WHERE id = 0').fetchone()[0]
+
+    def evict(self):
+        """Remove least recently used images until the cache fits within max_bytes."""
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        with self.lock:
+            while excess > 0:
+                rows = self.conn.execute('SELECT digest, size FROM blobs ORDER BY last_access LIMIT 64').fetchall()
+                if not rows:
+                    break
+                for digest, size in rows:
+                    if excess <= 0:
+                        break
+                    self.conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+                    self.conn.execute('DELETE FROM urls WHERE digest = ?', (digest,))
+                    try:
+                        os.remove(self.blob_path(digest))
+                    except FileNotFoundError:
+                        pass
+                    excess -= size
+            self.conn.commit()
+
+    def close(self):
+        """Close the index database."""
+        self.conn.close()
@@ -0,0 +1,106 @@
+import time
+import threading
+import requests
+import metrics
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from image_cache import ImageCache, CACHE_MAX_BYTES
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ImageFetcher:
+    """Fetch image bytes concurrently over a single pooled HTTP session.
+
+    When cache_dir is given, images are read from and saved to an ImageCache
+    so each URL crosses the network at most once across runs.
+    """
+
+    def __init__(self, concurrency=16, per_host=8, timeout=10, retries=3, backoff=0.5,
+                 cache_dir=None, cache_max_bytes=CACHE_MAX_BYTES):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+        self.cache = ImageCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+    def host_semaphore(self, url):
+        """Return the semaphore limiting concurrent requests to the host of url."""
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_semaphores[host]
+
+    def fetch(self, url):
+        """Return the body of url from the cache or the network, or None on failure."""
+        if self.cache is not None:
+            content = self.cache.get(url)
+            metrics.inc('image_cache_lookups', result='miss' if content is None else 'hit')
+            if content is not None:
+                return content
+        content = self.download(url)
+        if content is not None and self.cache is not None:
+            self.cache.put(url, content)
+        return content
+
+    def path(self, url):
+        """Return the local cached file path of the image at url, downloading it if needed."""
+        if self.cache is None:
+            raise ValueError('ImageFetcher.path requires a cache_dir')
+        if self.fetch(url) is None:
+            return None
+        return self.cache.path(url)
+
+    def download(self, url):
+        """Return the body of url, retrying with exponential backoff, or None on failure."""
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            if attempt:
+                metrics.inc('image_download_retries')
+            try:
+                with self.host_semaphore(url):
+                    with metrics.timer('image_download_seconds'):
+                        response = self.session.get(url, timeout=self.timeout)
+                if response.status_code == 200:
+                    metrics.inc('image_downloads', outcome='ok')
+                    metrics.inc('image_download_bytes', len(response.content))
+                    return response.content
+                if response.status_code not in RETRY_STATUSES:
+                    metrics.inc('image_downloads', outcome='failed')
+                    return None
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            except requests.RequestException:
+                pass
+            if attempt < self.retries:
+                time.sleep(delay)
+        metrics.inc('image_downloads', outcome='failed')
+        return None
+
+    def fetch_all(self, urls, transform=None):
+        """Fetch urls concurrently and return a dict of url -> body (or transform(body))."""
+        def task(url):
+            content = self.fetch(url)
+            if transform is None or content is None:
+                return content
+            return transform(content)
+        unique_urls = list(dict.fromkeys(urls))
+        return dict(zip(unique_urls, self.executor.map(task, unique_urls)))
+
+    def close(self):
+        """Shut down the worker threads and the HTTP session."""
+        self.executor.shutdown()
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,115 @@
+import io
+import hashlib
+import threading
+from image_cache import ImageCache, CACHE_DIR, CACHE_MAX_BYTES
+
+MAX_EDGE = 1024
+QUALITY = 85
+FORMATS = {'jpeg': ('JPEG', 'image/jpeg'), 'webp': ('WEBP', 'image/webp')}
+KEEP_MIMES = {'image/jpeg', 'image/webp'}
+
+
+def sniff_mime(data):
+    """Return the MIME type of image bytes from their signature, or None if it is not recognised."""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:4] == b'GIF8':
+        return 'image/gif'
+    return None
+
+
+class ImagePreprocessor:
+    """Downscale and re-encode images before they are sent to a vision model.
+
+    Images are shrunk so their longest edge is at most max_edge pixels and
+    re-encoded as JPEG or WebP. JPEG and WebP files that are already small
+    enough are sent unchanged, and PNGs such as screenshots stay PNG when
+    that is smaller than the re-encoded image. When cache_dir is given,
+    prepared payloads are stored in the ImageCache there, keyed on the source
+    content and the settings, so each image is encoded once across runs.
+    """
+
+    def __init__(self, max_edge=MAX_EDGE, format='jpeg', quality=QUALITY, cache_dir=CACHE_DIR, cache_max_bytes=CACHE_MAX_BYTES):
+        if format not in FORMATS:
+            raise ValueError(f'Unsupported image format: {format}')
+        self.max_edge = max_edge
+        self.format = format
+        self.quality = quality
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.image_cache = None
+        self.lock = threading.Lock()
+
+    def cache(self):
+        """Return the ImageCache of prepared payloads, opening it on first use, or None."""
+        if self.cache_dir is None:
+            return None
+        with self.lock:
+            if self.image_cache is None:
+                self.image_cache = ImageCache(self.cache_dir, self.cache_max_bytes)
+            return self.image_cache
+
+    def fits(self, size):
+        """Return True if an image of the given (width, height) needs no downscaling."""
+        return not self.max_edge or max(size) <= self.max_edge
+
+    def encode(self, data):
+        """Return the payload to send for image bytes and its MIME type."""
+        import PIL.Image
+        import PIL.ImageOps
+        mime = sniff_mime(data)
+        img = PIL.Image.open(io.BytesIO(data))
+        fits = self.fits(img.size)
+        if fits and mime in KEEP_MIMES:
+            return data, mime
+        if self.max_edge and img.format == 'JPEG':
+            img.draft('RGB', (self.max_edge, self.max_edge))
+        img = PIL.ImageOps.exif_transpose(img)
+        if self.max_edge:
+            img.thumbnail((self.max_edge, self.max_edge), PIL.Image.LANCZOS)
+        pil_format, encoded_mime = FORMATS[self.format]
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        candidates = [(self.save(img, pil_format, has_alpha), encoded_mime)]
+        if mime == 'image/png':
+            candidates.append((self.save(img, 'PNG', has_alpha), mime))
+            if fits:
+                candidates.append((data, mime))
+        return min(candidates, key=lambda candidate: len(candidate[0]))
+
+    def save(self, img, pil_format, has_alpha):
+        """Return img encoded in pil_format, flattening transparency onto white for JPEG."""
+        import PIL.Image
+        if has_alpha and pil_format == 'JPEG':
+            rgba = img.convert('RGBA')
+            img = PIL.Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+        buffer = io.BytesIO()
+        if pil_format == 'PNG':
+            img.save(buffer, pil_format)
+        else:
+            img.save(buffer, pil_format, quality=self.quality, optimize=pil_format == 'JPEG')
+        return buffer.getvalue()
+
+    def settings(self):
+        """Return a string identifying the settings that determine the prepared payload of an image."""
+        return f'{self.max_edge}:{self.format}:{self.quality}'
+
+    def prepare(self, image_path):
+        """Return the payload bytes to send for the image file at image_path and their MIME type."""
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        cache = self.cache()
+        if cache is None:
+            return self.encode(data)
+        key = f'prepared:{hashlib.sha256(data).hexdigest()}:{self.settings()}'
+        payload = cache.get(key)
+        if payload is None:
+            payload, _ = self.encode(data)
+            cache.put(key, payload)
+        return payload, sniff_mime(payload)
@@ -0,0 +1,96 @@
+import os
+import json
+import threading
+
+
+def repair_tail(path):
+    """Truncate a partially written last line left by a crash, so appends start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+
+def iter_records(path):
+    """Yield the complete records of a results log, skipping a partially written last line.
+
+    Safe to call while a job is still appending to the log.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def read_results(path):
+    """Return the latest record of every tweet id in a results log, in log order."""
+    records = {}
+    for record in iter_records(path):
+        records.pop(record['id'], None)
+        records[record['id']] = record
+    return list(records.values())
+
+
+class ResultsLog:
+    """Append-only JSON lines log of classification results keyed by tweet id.
+
+    Each record is written as one line and flushed immediately, and the file
+    is fsynced every fsync_every records, so after a crash at most the last
+    partial line is lost. A tweet counts as completed once it has a record
+    with a response; records with errors are retried on the next run.
+    """
+
+    def __init__(self, path, fsync_every=100):
+        self.path = path
+        self.fsync_every = fsync_every
+        repair_tail(path)
+        self.completed = {record['id'] for record in iter_records(path) if record.get('response') is not None}
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def is_completed(self, tweet_id):
+        """Return True if tweet_id already has a response in the log."""
+        return tweet_id in self.completed
+
+    def append(self, record):
+        """Append one result record to the log."""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            if record.get('response') is not None:
+                self.completed.add(record['id'])
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def close(self):
+        """Sync and close the log."""
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
@@ -0,0 +1,57 @@
+import re
+
+
+def build_trie(words):
+    """Build a character trie of words as nested dicts, marking word ends with ''."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return trie
+
+
+def trie_to_pattern(trie):
+    """Convert a trie into a regex that matches the same words without a flat alternation."""
+    ends_here = '' in trie
+    branches = [re.escape(char) + trie_to_pattern(child) for char, child in sorted(trie.items()) if char]
+    if not branches:
+        return ''
+    if len(branches) == 1 and not ends_here:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if ends_here else pattern
+
+
+class KeywordMatcher:
+    """Case-insensitive multi-keyword matcher compiled from a trie of the keywords.
+
+    Keywords sharing a prefix share a single regex branch, so the engine
+    never retries the same prefix once per keyword as with a flat
+    alternation. English keywords are matched as whole words; with
+    word_boundary=False (e.g. for Japanese) they match as substrings.
+    """
+
+    def __init__(self, words, word_boundary=True):
+        self.words = list(dict.fromkeys(words))
+        self.canonical = {word.lower(): word for word in self.words}
+        pattern = trie_to_pattern(build_trie(self.canonical))
+        if word_boundary:
+            pattern = r'\b' + pattern + r'\b'
+        self.regex = re.compile(pattern, re.IGNORECASE)
+
+    def contains(self, texts):
+        """Return a boolean Series telling which texts contain a keyword."""
+        return texts.str.contains(self.regex, na=False)
+
+    def find_terms(self, text):
+        """Return the distinct keywords found in a text, in order of first appearance."""
+        if not isinstance(text, str):
+            return []
+        found = self.regex.findall(text)
+        return list(dict.fromkeys(self.canonical.get(term.lower(), term) for term in found))
+
+    def matches(self, texts):
+        """Return a Series with the list of distinct keywords found in each text."""
+        return texts.apply(self.find_terms)
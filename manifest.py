@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import sqlite3
+from file_hash import file_digest
+
+MANIFEST_FILE = '.manifest.sqlite'
+
+
+def manifest_path(save_folder):
+    """Return the path of the manifest kept in a stage's output folder."""
+    return os.path.join(save_folder, MANIFEST_FILE)
+
+
+class Manifest:
+    """Record of the input files a stage has processed, so reruns only process new or changed files.
+
+    Each entry holds the size, modification time and SHA-256 digest an input
+    file had when it was processed, the parameters that affect its outputs,
+    the output paths and optional stage-specific data. A file is up to date
+    if its content is unchanged, it was processed with the same parameters
+    and all its outputs exist. The digest is only computed when the size or
+    modification time differ, so unchanged files cost one stat per check.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                          'mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL, params TEXT NOT NULL, outputs TEXT NOT NULL, '
+                          'extra TEXT, processed REAL NOT NULL)')
+        self.conn.commit()
+
+    def get(self, filepath):
+        """Return the entry of an input file as a dict, or None if it was never processed."""
+        row = self.conn.execute('SELECT size, mtime_ns, sha256, params, outputs, extra, processed FROM files WHERE path = ?',
+                                (os.path.abspath(filepath),)).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, sha256, params, outputs, extra, processed = row
+        return {'path': os.path.abspath(filepath), 'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256,
+                'params': json.loads(params), 'outputs': json.loads(outputs),
+                'extra': json.loads(extra) if extra else None, 'processed': processed}
+
+    def fingerprint(self, filepath):
+        """Return the size, modification time and content digest of a file, taking the stat first."""
+        stat = os.stat(filepath)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_digest(filepath)}
+
+    def pending(self, filepaths, params):
+        """Return (filepath, fingerprint) for the files that are new, changed or processed with other params.
+
+        Files whose content is unchanged but whose modification time moved
+        have their entry updated instead.
+        """
+        params = json.loads(json.dumps(params))
+        pending = []
+        for filepath in filepaths:
+            entry = self.get(filepath)
+            stat = os.stat(filepath)
+            current = (entry is not None and entry['params'] == params
+                       and all(os.path.exists(output) for output in entry['outputs']))
+            if current and (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            fingerprint = self.fingerprint(filepath)
+            if current and fingerprint['sha256'] == entry['sha256']:
+                self.conn.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?',
+                                  (fingerprint['size'], fingerprint['mtime_ns'], entry['path']))
+                self.conn.commit()
+                continue
+            pending.append((filepath, fingerprint))
+        return pending
+
+    def record(self, filepath, fingerprint, outputs, params, extra=None):
+        """Record that filepath, as described by the fingerprint taken before processing it, was processed."""
+        self.conn.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, params, outputs, extra, processed) '
+                          'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (os.path.abspath(filepath), fingerprint['size'], fingerprint['mtime_ns'], fingerprint['sha256'],
+                           json.dumps(params, sort_keys=True), json.dumps(outputs),
+                           None if extra is None else json.dumps(extra), time.time()))
+        self.conn.commit()
+
+    def close(self):
+        """Close the manifest database."""
+        self.conn.close()
+
+
+def watch(run, interval):
+    """Call run() every interval seconds until interrupted, so files that appear in the meantime are processed."""
+    try:
+        while True:
+            time.sleep(interval)
+            run()
+    except KeyboardInterrupt:
+        print('Stopped watching')
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import math
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms with optional labels.
+
+    Timers are histograms of durations in seconds. The registry can be
+    exported as a JSON report or in the Prometheus text format, and the
+    metrics of worker processes can be drained there and merged here.
+    """
+
+    def __init__(self, prefix='earthquake_damage_'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.profile_dir = None
+        self.profile_pid = None
+        self.profiles = {}
+        self.profiling = threading.local()
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Record one observation in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the with block in the histogram name, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, iterable, name, **labels):
+        """Yield from iterable and observe the total time spent producing its items, e.g. parsing a file."""
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.observe(name, elapsed, **labels)
+
+    def enable_profiling(self, directory):
+        """Profile every stage with cProfile and write <directory>/<stage>.prof after each run of it.
+
+        Forked worker processes write <stage>.<pid>.prof instead, so they do
+        not overwrite each other's profiles.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.profile_dir = directory
+        self.profile_pid = os.getpid()
+
+    def profile_path(self, name):
+        """Return the file the profile of stage name is written to by this process."""
+        pid = os.getpid()
+        filename = f'{name}.prof' if pid == self.profile_pid else f'{name}.{pid}.prof'
+        return os.path.join(self.profile_dir, filename)
+
+    @contextmanager
+    def stage(self, name):
+        """Time one run of a pipeline stage, profiling it if profiling is enabled.
+
+        Only the outermost stage of a thread is profiled, and cProfile only
+        sees the calling thread, not its worker threads. Stages run in worker
+        processes are profiled there, into files named after the worker.
+        """
+        profile = None
+        if self.profile_dir and not getattr(self.profiling, 'active', False):
+            import cProfile
+            with self.lock:
+                profile = self.profiles.setdefault(name, cProfile.Profile())
+            self.profiling.active = True
+            profile.enable()
+        try:
+            with self.timer('stage_seconds', stage=name):
+                yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.profiling.active = False
+                profile.dump_stats(self.profile_path(name))
+
+    def drain(self):
+        """Return the metrics recorded so far as a picklable snapshot and reset them.
+
+        Worker pools also call it as their initializer, so forked workers do
+        not report the metrics they inherited from the parent again.
+        """
+        with self.lock:
+            snapshot = {'counters': self.counters, 'histograms': self.histograms}
+            self.counters = {}
+            self.histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add a snapshot drained from another registry, such as a worker process's."""
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in snapshot['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    self.histograms[key] = {**other, 'counts': list(other['counts'])}
+                    continue
+                histogram['counts'] = [a + b for a, b in zip(histogram['counts'], other['counts'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+
+    def to_dict(self):
+        """Return the metrics as a JSON-serialisable report."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, counts=list(value['counts']))) for key, value in self.histograms.items())
+        report = {'counters': {}, 'histograms': {}}
+        for (name, labels), value in counters:
+            report['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in histograms:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                cumulative += count
+                buckets['+Inf' if bound == math.inf else repr(bound)] = cumulative
+            report['histograms'].setdefault(name, []).append({
+                'labels': dict(labels), 'count': histogram['count'], 'sum': round(histogram['sum'], 6),
+                'mean': round(histogram['sum'] / histogram['count'], 6) if histogram['count'] else None, 'buckets': buckets})
+        return report
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        def label_text(labels, extra=None):
+            pairs = list(labels.items()) + (list(extra.items()) if extra else [])
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+        report = self.to_dict()
+        lines = []
+        for name, series in report['counters'].items():
+            metric = f'{self.prefix}{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.extend(f"{metric}{label_text(entry['labels'])} {entry['value']}" for entry in series)
+        for name, series in report['histograms'].items():
+            metric = f'{self.prefix}{name}'
+            lines.append(f'# TYPE {metric} histogram')
+            for entry in series:
+                for bound, count in entry['buckets'].items():
+                    lines.append(f"{metric}_bucket{label_text(entry['labels'], {'le': bound})} {count}")
+                lines.append(f"{metric}_sum{label_text(entry['labels'])} {entry['sum']}")
+                lines.append(f"{metric}_count{label_text(entry['labels'])} {entry['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to path, in the Prometheus format if it ends with .prom and as JSON otherwise."""
+        if path.endswith('.prom'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2) + '\n'
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+# Registry shared by the pipeline modules of this process.
+registry = Metrics()
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
+stage = registry.stage
+enable_profiling = registry.enable_profiling
+drain = registry.drain
+merge = registry.merge
+write = registry.write
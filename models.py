@@ -1,97 +1,330 @@
+import sys
 import time
+import random
 import base64
-import PIL.Image
-from openai import OpenAI
-import google.generativeai as genai
+import threading
+import metrics
+from functools import lru_cache
 from prompts import *
+from image_preprocess import ImagePreprocessor
 
 SECRET_FILE = 'secrets.txt'
+# Completion token limit of a single-tweet or single-image request.
+RESPONSE_TOKENS = 1000
 
-with open('secrets.txt') as f:
-    lines = f.readlines()
-    for line in lines:
-        if line.split(',')[0].strip() == "openai_key":
-            openai_key = line.split(',')[1].strip()
-        elif line.split(',')[0].strip() == "gemini_key":
-            gemini_key = line.split(',')[1].strip()
 
+@lru_cache(maxsize=None)
+def load_secrets():
+    """Read the API keys from SECRET_FILE on first use and return them as a dict."""
+    secrets = {}
+    with open(SECRET_FILE) as f:
+        lines = f.readlines()
+        for line in lines:
+            if line.split(',')[0].strip() == "openai_key":
+                secrets['openai_key'] = line.split(',')[1].strip()
+            elif line.split(',')[0].strip() == "gemini_key":
+                secrets['gemini_key'] = line.split(',')[1].strip()
+    return secrets
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ModelError(Exception):
+    """A model call failed and retrying it would not help."""
+
+
+class RetryableModelError(ModelError):
+    """A model call failed transiently (rate limit, timeout, server error)."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitError(RetryableModelError):
+    """The provider rejected a model call because of its rate limits."""
+
+
+class CircuitOpenError(ModelError):
+    """Calls to a provider are suspended after repeated transient failures."""
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped at max_delay and raised to any retry-after hint."""
+
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        """Return the seconds to wait before retry number attempt (counting from 0)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class RetryBudget:
+    """Caps retries at a fraction of calls, so a failing provider is not hit with a retry storm.
+
+    Every call deposits ratio tokens and every retry withdraws one. The
+    balance never exceeds max_tokens, so a long run of successful calls
+    banks at most max_tokens retries for when a provider starts failing.
+    """
+
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        """Record a call."""
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self):
+        """Take one retry from the budget and return False if it is exhausted."""
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive transient failures and lets one trial call through after reset_timeout."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def before_call(self, provider):
+        """Raise CircuitOpenError if calls to provider are currently suspended."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.trial_running:
+                raise CircuitOpenError(f'{provider} circuit open after {self.failures} consecutive failures')
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+retry_policy = RetryPolicy()
+retry_budget = RetryBudget()
+circuit_breakers = {'openai': CircuitBreaker(), 'gemini': CircuitBreaker()}
+
+
+def parse_retry_after(error):
+    """Return the retry-after hint in seconds carried by a provider error, if any."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def to_model_error(provider, error):
+    """Convert an exception raised by a provider SDK into a typed ModelError."""
+    if isinstance(error, ModelError):
+        return error
+    message = f'{provider}: {type(error).__name__}: {error}'
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if status == 429:
+        return RateLimitError(message, parse_retry_after(error))
+    connection_errors = (ConnectionError, TimeoutError)
+    if 'openai' in sys.modules:
+        connection_errors += (sys.modules['openai'].APIConnectionError,)
+    if status in RETRYABLE_STATUSES or isinstance(error, connection_errors):
+        return RetryableModelError(message, parse_retry_after(error))
+    return ModelError(message)
+
+
+def call_with_retries(provider, function, *args):
+    """Call function(*args), retrying transient failures with backoff, the retry budget and the provider's circuit breaker."""
+    breaker = circuit_breakers[provider]
+    retry_budget.deposit()
+    for attempt in range(retry_policy.max_attempts):
+        if attempt:
+            metrics.inc('model_retries', provider=provider)
+        try:
+            breaker.before_call(provider)
+        except ModelError as e:
+            metrics.inc('model_errors', provider=provider, type=type(e).__name__)
+            raise
+        try:
+            with metrics.timer('model_request_seconds', provider=provider):
+                result = function(*args)
+        except Exception as e:
+            error = to_model_error(provider, e)
+            metrics.inc('model_requests', provider=provider, outcome='error')
+            if not isinstance(error, RetryableModelError):
+                # The provider answered, so this does not count towards opening the circuit.
+                breaker.record_success()
+                metrics.inc('model_errors', provider=provider, type=type(error).__name__)
+                raise error from e
+            breaker.record_failure()
+            if attempt == retry_policy.max_attempts - 1 or not retry_budget.withdraw():
+                metrics.inc('model_errors', provider=provider, type=type(error).__name__)
+                raise error from e
+            time.sleep(retry_policy.delay(attempt, error.retry_after))
+            continue
+        breaker.record_success()
+        metrics.inc('model_requests', provider=provider, outcome='ok')
+        return result
+
+
+def record_usage(provider, response):
+    """Count the prompt and completion tokens reported in a model response, if any."""
+    if provider == 'openai':
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+    else:
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None)
+        completion_tokens = getattr(usage, 'candidates_token_count', None)
+    if prompt_tokens:
+        metrics.inc('model_tokens', prompt_tokens, provider=provider, kind='prompt')
+    if completion_tokens:
+        metrics.inc('model_tokens', completion_tokens, provider=provider, kind='completion')
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """Return the shared OpenAI client; retries are handled by call_with_retries."""
+    from openai import OpenAI
+    return OpenAI(api_key=load_secrets()['openai_key'], max_retries=0)
+
+
+@lru_cache(maxsize=None)
+def get_gemini_model(name):
+    """Return a cached Gemini model, configuring the API key once."""
+    import google.generativeai as genai
+    genai.configure(api_key=load_secrets()['gemini_key'])
+    return genai.GenerativeModel(name)
+
+
+# Downscales and re-encodes images before upload; replace it to change the settings.
+image_preprocessor = ImagePreprocessor()
 
-openai_client = OpenAI(api_key=openai_key)
 
 def encode_image64(image_path):
-    """Encode an image to base64."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+    """Encode a preprocessed image to base64 and return it with its MIME type."""
+    data, mime_type = image_preprocessor.prepare(image_path)
+    return base64.b64encode(data).decode("utf-8"), mime_type
 
 
-def call_gpt4o_text(message):
+def call_gpt4o_text(message, max_tokens=RESPONSE_TOKENS):
     """Call the GPT-4o model for text information and return the response."""
-    response = openai_client.chat.completions.create(
-        model = "gpt-4o", 
-        messages=[{"role": "user", 
-                   "content": message}],
-        temperature=0.0,
-        max_tokens=1000
-    )
-    return response.choices[0].message.content
+    def request():
+        response = get_openai_client().chat.completions.create(
+            model = "gpt-4o", 
+            messages=[{"role": "user", 
+                       "content": message}],
+            temperature=0.0,
+            max_tokens=max_tokens
+        )
+        record_usage('openai', response)
+        return response.choices[0].message.content
+    return call_with_retries('openai', request)
 
 
 def call_gpt4o_image(message, image):
     """Call the GPT-4o model for image information and return the response."""
-    base64_image = encode_image64(image)
-    response = openai_client.chat.completions.create(
-        model = "gpt-4o", 
-        messages=[{"role": "user", 
-                   "content": [
-                    {"type": "text", "text": message},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}]
-                    }],
-        temperature=0.0,
-        max_tokens=1000
-    )
-    return response.choices[0].message.content
-
-
-def call_gemini_text(message):
+    base64_image, mime_type = encode_image64(image)
+    def request():
+        response = get_openai_client().chat.completions.create(
+            model = "gpt-4o", 
+            messages=[{"role": "user", 
+                       "content": [
+                        {"type": "text", "text": message},
+                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}]
+                        }],
+            temperature=0.0,
+            max_tokens=RESPONSE_TOKENS
+        )
+        record_usage('openai', response)
+        return response.choices[0].message.content
+    return call_with_retries('openai', request)
+
+
+def gemini_text(response):
+    """Return the text of a Gemini response, raising ModelError if it was blocked or empty."""
+    try:
+        return response.text
+    except ValueError as e:
+        raise ModelError(f'gemini: no text in response: {e}') from e
+
+
+def call_gemini_text(message, max_tokens=RESPONSE_TOKENS):
     """Call the Gemini model for text information and return the response."""
-    retries = 20
-    while retries > 0:
-        try:
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-pro')
-            response = model.generate_content(message)
-            return response.text
-        except Exception as e:
-            retries -= 1
-            time.sleep(0.1)
+    def request():
+        response = get_gemini_model('gemini-pro').generate_content(message, generation_config={'max_output_tokens': max_tokens})
+        record_usage('gemini', response)
+        return gemini_text(response)
+    return call_with_retries('gemini', request)
 
 
 def call_gemini_image(message, image):
     """Call the Gemini model for image information and return the response."""
-    retries = 20
-    while retries > 0:
-        try:
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            img = PIL.Image.open(image)
-            response = model.generate_content([message, img], stream=True)
-            response.resolve()
-            return response.text
-        except Exception as e:
-            retries -= 1
-            time.sleep(0.1)
+    data, mime_type = image_preprocessor.prepare(image)
+    img = {'mime_type': mime_type, 'data': data}
+    def request():
+        response = get_gemini_model('gemini-1.5-flash').generate_content([message, img], stream=True)
+        response.resolve()
+        record_usage('gemini', response)
+        return gemini_text(response)
+    return call_with_retries('gemini', request)
+
 
+def call_model(model, input, message, image=None, cache=None, max_tokens=RESPONSE_TOKENS):
+    """Call the model based on the input and model type.
 
-def call_model(model, input, message, image=None):
-    """Call the model based on the input and model type."""
+    Raises a ModelError subclass if the call fails after retries. If a
+    ResponseCache is given, a cached response is returned instead of calling
+    the model, and new responses are added to it. max_tokens caps the
+    completion of text requests, e.g. higher for a batch of tweets.
+    """
+    if cache is not None:
+        key, result = cache.lookup(model, input, message, image, image_preprocessor.settings())
+        if result is not None:
+            return result
     if model == 'gpt4' and input == 'text':
-        result = call_gpt4o_text(message)
+        result = call_gpt4o_text(message, max_tokens)
     elif model == 'gpt4' and input == 'image':
         result = call_gpt4o_image(message, image)
     elif model == 'gemini' and input == 'text':
-        result = call_gemini_text(message)
+        result = call_gemini_text(message, max_tokens)
     elif model == 'gemini' and input == 'image':
         result = call_gemini_image(message, image)
+    else:
+        raise ValueError(f'Unsupported model and input: {model}, {input}')
+    if cache is not None and result is not None:
+        cache.put(key, model, input, result)
     return result
 
 
@@ -0,0 +1,117 @@
+import numpy as np
+from PIL import Image
+
+
+def bits_to_hex(bits):
+    """Pack a boolean array of 64 bits into a 16-character hex string."""
+    return np.packbits(bits.ravel()).tobytes().hex()
+
+
+def dhash(image, hash_size=8):
+    """Compute the difference hash of a PIL image as a hex string."""
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return bits_to_hex(pixels[:, 1:] > pixels[:, :-1])
+
+
+def dct_matrix(n):
+    """Return the orthonormal DCT-II matrix of size n x n."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT_32 = dct_matrix(32)
+
+
+def phash(image, hash_size=8):
+    """Compute the DCT-based perceptual hash of a PIL image as a hex string."""
+    size = hash_size * 4
+    dct = DCT_32 if size == 32 else dct_matrix(size)
+    gray = image.convert('L').resize((size, size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    return bits_to_hex(low > np.median(low.ravel()[1:]))
+
+
+HASH_FUNCTIONS = {'phash': phash, 'dhash': dhash}
+
+
+class BKTree:
+    """Burkhard-Keller tree over hex hashes for Hamming-distance range queries."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, hash_value):
+        """Insert a hash into the tree."""
+        value = int(hash_value, 16)
+        if self.root is None:
+            self.root = (value, {})
+            self.size += 1
+            return
+        node = self.root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, hash_value, threshold):
+        """Return (distance, hash) pairs of stored hashes within threshold bits of hash_value."""
+        if self.root is None:
+            return []
+        value = int(hash_value, 16)
+        width = len(hash_value)
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = (value ^ node_value).bit_count()
+            if distance <= threshold:
+                matches.append((distance, format(node_value, f'0{width}x')))
+            for child_distance, child in children.items():
+                if distance - threshold <= child_distance <= distance + threshold:
+                    stack.append(child)
+        return sorted(matches)
+
+
+class NearDuplicateIndex:
+    """Index of perceptual hashes answering whether an image is a near duplicate of an earlier one.
+
+    When a HashStore is given, previously indexed hashes are loaded from it and
+    new ones are written back, so near duplicates are also caught across runs.
+    """
+
+    def __init__(self, algorithm='phash', threshold=8, store=None):
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.store = store
+        self.tree = BKTree()
+        if store is not None:
+            for hash_value in store.phashes(algorithm):
+                self.tree.add(hash_value)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def is_near_duplicate(self, hash_value, ignore=()):
+        """Return True if an indexed hash other than those in ignore lies within threshold bits of hash_value."""
+        return any(match not in ignore for _, match in self.tree.search(hash_value, self.threshold))
+
+    def add(self, hash_value):
+        """Index a perceptual hash."""
+        self.tree.add(hash_value)
+        if self.store is not None:
+            self.store.add_phash(self.algorithm, hash_value)
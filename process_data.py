@@ -2,63 +2,149 @@ import os
 import ast
 import argparse
 import pandas as pd
-import pickle
-import requests
 import hashlib
-from PIL import Image
 from io import BytesIO
 from word_list import *
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from image_cache import CACHE_DIR, CACHE_MAX_BYTES
+from hash_store import HashStore
+from functools import partial, lru_cache
+from keyword_matcher import KeywordMatcher
+from table_io import EXTENSIONS, FORMATS, read_table, write_table
+from manifest import Manifest, manifest_path, watch
+import metrics
 
-tqdm.pandas()
+# Image libraries (PIL, NumPy, requests, tqdm) are imported where they are
+# first needed, so that importing this module for filter_dataset is fast and
+# has no side effects.
 
-HASHES_FILE = 'seen_hashes.pkl'
+HASHES_FILE = 'seen_hashes.sqlite'
+LEGACY_HASHES_FILE = 'seen_hashes.pkl'
 
 def load_seen_hashes():
-    """Load the set of seen image hashes from a file."""
-    try:
-        with open(HASHES_FILE, 'rb') as f:
-            return pickle.load(f)
-    except FileNotFoundError:
-        return set()
+    """Open the store of seen image hashes, importing a legacy pickle on first use."""
+    return HashStore(HASHES_FILE, legacy_pickle=LEGACY_HASHES_FILE)
     
 def save_seen_hashes(seen_hashes):
-    """Save the set of seen image hashes to a file."""
-    with open(HASHES_FILE, 'wb') as f:
-        pickle.dump(seen_hashes, f)
+    """Persist the image hashes added since the last save."""
+    seen_hashes.commit()
+
+seen_hashes = None
+fetcher = None
+url_hashes = {}
+url_phashes = {}
+fetch_counts = {'fetched': 0, 'avoided': 0}
+
 
-seen_hashes = load_seen_hashes()
+def get_seen_hashes():
+    """Return the store of seen image hashes of this process, opening it on first use."""
+    global seen_hashes
+    if seen_hashes is None:
+        seen_hashes = load_seen_hashes()
+    return seen_hashes
 
 
-def filter_dataset(df, language):
-    """Filter dataset based on language and damage words."""
+@lru_cache(maxsize=None)
+def get_matcher(language):
+    """Return the damage word matcher of a language, compiling it on first use."""
     if language == 'english':
-        pattern = '|'.join(r'\b{}\b'.format(word) for word in damage_words_english)
-        filtered_df = df[df['text'].str.contains(pattern, case=False, na=False)]
+        return KeywordMatcher(damage_words_english, word_boundary=True)
     elif language == 'japanese':
-        pattern = '|'.join(damage_words_japanese)
-        filtered_df = df[df['text'].str.contains(pattern, case=False, na=False)]
+        return KeywordMatcher(damage_words_japanese, word_boundary=False)
+    raise ValueError(f'Unsupported language: {language}')
+
+
+def filter_dataset(df, language, terms_column=None):
+    """Filter dataset based on language and damage words.
+
+    If terms_column is given, the damage words found in each kept tweet are
+    listed in that column.
+    """
+    matcher = get_matcher(language)
+    with metrics.timer('filter_seconds', stage='process_data'):
+        filtered_df = df[matcher.contains(df['text'])]
+        if terms_column:
+            filtered_df = filtered_df.assign(**{terms_column: matcher.matches(filtered_df['text'])})
+    metrics.inc('tweets_filtered', len(df), stage='process_data')
+    metrics.inc('tweets_matched', len(filtered_df), stage='process_data')
     return filtered_df
 
 
-def compute_image_hash(url):
-    """Compute the MD5 hash of the image at the given URL."""
+def get_fetcher(**fetch_options):
+    """Return the ImageFetcher of this process, creating it on first use."""
+    global fetcher
+    if fetcher is None:
+        from image_fetch import ImageFetcher
+        fetcher = ImageFetcher(**fetch_options)
+    return fetcher
+
+
+def hash_image_content(content, perceptual=None):
+    """Compute the MD5 hash of the decoded pixels of an image and, if requested, its perceptual hash."""
+    from PIL import Image
+    from perceptual_hash import HASH_FUNCTIONS
     try:
-        response = requests.get(url)
-        image = Image.open(BytesIO(response.content))
+        image = Image.open(BytesIO(content))
         hash_md5 = hashlib.md5(image.tobytes())
-        return hash_md5.hexdigest()
+        phash = HASH_FUNCTIONS[perceptual](image) if perceptual else None
+        return hash_md5.hexdigest(), phash
     except Exception as e:
-        return None
+        return None, None
 
 
-def combine_urls(row, seen_hashes):
+def clear_url_memo():
+    """Forget the URL hashes and fetch counts of a previous run."""
+    url_hashes.clear()
+    url_phashes.clear()
+    fetch_counts.update(fetched=0, avoided=0)
+
+
+def hash_urls(urls, fetcher, batch_size=256, progress=True, perceptual=None):
+    """Return the hash of every URL, fetching each distinct URL at most once per run.
+
+    With perceptual set to 'phash' or 'dhash', the perceptual hash of each URL
+    is also computed from the same download and kept in url_phashes. URLs that
+    could not be fetched or hashed get None and are not memoized, so they are
+    tried again by later files.
+    """
+    new_urls = [url for url in dict.fromkeys(urls) if url not in url_hashes or (perceptual and url not in url_phashes)]
+    fetch_counts['fetched'] += len(new_urls)
+    fetch_counts['avoided'] += len(urls) - len(new_urls)
+    metrics.inc('image_fetches', len(new_urls), stage='process_data')
+    metrics.inc('image_fetches_avoided', len(urls) - len(new_urls), stage='process_data')
+    from tqdm import tqdm
+    transform = partial(hash_image_content, perceptual=perceptual)
+    with tqdm(total=len(new_urls), disable=not progress) as progress_bar:
+        for start in range(0, len(new_urls), batch_size):
+            batch = new_urls[start:start + batch_size]
+            for url, result in fetcher.fetch_all(batch, transform).items():
+                if result is None or result[0] is None:
+                    metrics.inc('images_unhashable', stage='process_data')
+                    continue
+                url_hashes[url], phash = result
+                if perceptual:
+                    url_phashes[url] = phash
+            progress_bar.update(len(batch))
+    return [url_hashes.get(url) for url in urls]
+
+
+def compute_image_hash(url):
+    """Compute the MD5 hash of the image at the given URL."""
+    return hash_urls([url], get_fetcher(), progress=False)[0]
+
+
+def hash_image_lists(image_url_lists, fetcher, batch_size=256, perceptual=None):
+    """Hash the images of many rows in concurrent batches and return one hash list per row."""
+    hashes = iter(hash_urls([url for image_urls in image_url_lists for url in image_urls], fetcher, batch_size, perceptual=perceptual))
+    return [[next(hashes) for _ in image_urls] for image_urls in image_url_lists]
+
+
+def get_image_urls(row):
     """Combine the entity_image_url and extended_entity_image_urls into a single list."""
-    # Combine image_urls into a single list
     image_urls_list = []
     image_url = row['entity_image_url']
     extended_image_urls = row['extended_entity_image_urls']
-    if extended_image_urls and isinstance(extended_image_urls, str):
+    if isinstance(extended_image_urls, str) and extended_image_urls:
         extended_image_urls = ast.literal_eval(extended_image_urls)
     else:
         extended_image_urls = []
@@ -66,52 +152,251 @@ def combine_urls(row, seen_hashes):
         image_urls_list.append(image_url)
     if extended_image_urls:
         image_urls_list.extend(extended_image_urls)
-    
-    # Convert image_urls to hashes
-    hash_list = [compute_image_hash(url) for url in image_urls_list]
-    
-    # Filter out URLs whose hash has already been seen
+    return image_urls_list
+
+
+def dedup_urls(image_urls_list, hash_list, seen_hashes):
+    """Return the URLs whose hash has not been seen yet and record their hashes."""
     unique_urls = []
-    for url in image_urls_list:
-        hash_value = compute_image_hash(url)
+    for url, hash_value in zip(image_urls_list, hash_list):
         if hash_value and hash_value not in seen_hashes:
             seen_hashes.add(hash_value)
             unique_urls.append(url)
+    return unique_urls
+
+
+def near_dedup_urls(image_urls_list, phash_list, unique_urls, near_index):
+    """Return the unique URLs that are not near duplicates of an indexed image and index them."""
+    phashes = dict(zip(image_urls_list, phash_list))
+    near_unique_urls = []
+    for url in unique_urls:
+        phash = phashes.get(url)
+        if phash and not near_index.is_near_duplicate(phash):
+            near_index.add(phash)
+            near_unique_urls.append(url)
+    return near_unique_urls
+
+
+class ReleasedHashes:
+    """View of seen_hashes for reprocessing a changed file.
+
+    The hashes the file added on its previous run count as unseen until it
+    adds them again, so its images are not taken for duplicates of themselves.
+    """
+
+    def __init__(self, seen_hashes, released):
+        self.seen_hashes = seen_hashes
+        self.released = set(released)
+
+    def __contains__(self, hash_value):
+        return hash_value not in self.released and hash_value in self.seen_hashes
+
+    def add(self, hash_value):
+        self.released.discard(hash_value)
+        return self.seen_hashes.add(hash_value)
+
+
+class ReleasedNearIndex:
+    """View of a NearDuplicateIndex for reprocessing a changed file, ignoring the file's own earlier hashes."""
+
+    def __init__(self, near_index, released):
+        self.near_index = near_index
+        self.released = set(released)
+
+    def is_near_duplicate(self, hash_value):
+        return self.near_index.is_near_duplicate(hash_value, ignore=self.released)
+
+    def add(self, hash_value):
+        self.released.discard(hash_value)
+        self.near_index.add(hash_value)
+
+
+def combine_urls(row, seen_hashes):
+    """Combine the entity_image_url and extended_entity_image_urls into a single list."""
+    # Combine image_urls into a single list
+    image_urls_list = get_image_urls(row)
+    
+    # Convert image_urls to hashes, downloading each URL at most once per run
+    hash_list = hash_urls(image_urls_list, get_fetcher(), progress=False)
+    
+    # Filter out URLs whose hash has already been seen
+    unique_urls = dedup_urls(image_urls_list, hash_list, seen_hashes)
     return image_urls_list, hash_list, unique_urls
 
 
-def main(folder, language):
+def load_file(read_filepath, language):
+    """Read a converted tweet file and return it sorted by time along with its text-filtered rows."""
+    df = read_table(read_filepath)
+    df['text'] = df['text'].astype(str)
+    df = df[~df['text'].str.startswith('RT @')]
+    print(len(df))
+    metrics.inc('tweets_in', len(df), stage='process_data')
+    df['time'] = pd.to_datetime(df['time'], errors='coerce')
+    df = df.sort_values('time')
+    df1 = filter_dataset(df, language, terms_column='damage_terms')
+    return df, df1
+
+
+def hash_file(read_filepath, language, fetch_options=None, perceptual=None):
+    """Load a file and hash its images without consulting seen_hashes, so it can run in a worker.
+
+    Also returns how many fetches this file performed and avoided through the URL memo.
+    """
+    counts_before = dict(fetch_counts)
+    with metrics.stage('process_data.hash'):
+        df, df1 = load_file(read_filepath, language)
+        df['image_urls'] = [get_image_urls(row) for _, row in df.iterrows()]
+        with metrics.timer('image_hash_seconds', stage='process_data'):
+            df['image_hashes'] = hash_image_lists(list(df['image_urls']), get_fetcher(**(fetch_options or {})), perceptual=perceptual)
+        if perceptual:
+            df['image_phashes'] = [[url_phashes.get(url) for url in urls] for urls in df['image_urls']]
+    counts = {key: fetch_counts[key] - counts_before[key] for key in fetch_counts}
+    return df, df1, counts
+
+
+def hash_file_in_worker(read_filepath, language, fetch_options=None, perceptual=None):
+    """Run hash_file in a worker process and also return the metrics it recorded, to be merged by the parent."""
+    return hash_file(read_filepath, language, fetch_options, perceptual) + (metrics.drain(),)
+
+
+def dedup_file(df, seen_hashes, near_index=None):
+    """Add the unique_image_urls column and return the rows with at least one unseen image.
+
+    With a NearDuplicateIndex, near_unique_image_urls is added as well and rows
+    are kept only if one of their images is not a near duplicate.
+    """
+    df['unique_image_urls'] = [dedup_urls(urls, hashes, seen_hashes) for urls, hashes in zip(df['image_urls'], df['image_hashes'])]
+    if near_index is None:
+        return df[df['unique_image_urls'].apply(lambda x: len(x) > 0)]
+    df['near_unique_image_urls'] = [near_dedup_urls(urls, phashes, unique_urls, near_index)
+                                    for urls, phashes, unique_urls in zip(df['image_urls'], df['image_phashes'], df['unique_image_urls'])]
+    return df[df['near_unique_image_urls'].apply(lambda x: len(x) > 0)]
+
+
+def added_hashes(df):
+    """Return the image hashes and perceptual hashes a deduplicated file added to the stores."""
+    hashes = [hash_value for urls, hash_list, unique_urls in zip(df['image_urls'], df['image_hashes'], df['unique_image_urls'])
+              for url, hash_value in zip(urls, hash_list) if url in unique_urls]
+    phashes = []
+    if 'near_unique_image_urls' in df:
+        phashes = [phash for urls, phash_list, unique_urls in zip(df['image_urls'], df['image_phashes'], df['near_unique_image_urls'])
+                   for url, phash in zip(urls, phash_list) if url in unique_urls]
+    return {'hashes': hashes, 'phashes': phashes}
+
+
+def save_outputs(df1, df2, save_folder, file, fmt='json'):
+    """Save the text-filtered and image-deduplicated DataFrames of a file and return their paths."""
+    save_file1 = file.split('.')[0] + '_text' + EXTENSIONS[fmt]
+    save_file2 = file.split('.')[0] + '_image' + EXTENSIONS[fmt]
+    save_filepath1 = os.path.join(save_folder, save_file1)
+    save_filepath2 = os.path.join(save_folder, save_file2)
+    write_table(df1, save_filepath1, lines=True)
+    write_table(df2, save_filepath2, lines=True)
+    print(f'{save_file1} and {save_file2} saved')
+    return [save_filepath1, save_filepath2]
+
+
+def main(folder, language, workers=1, fetch_options=None, perceptual=None, phash_threshold=8, fmt='json', force=False):
+    """Filter and deduplicate the new or changed files of a folder into <folder>_filtered.
+
+    Files recorded in the manifest of the output folder as processed with the
+    same options and unchanged since are skipped unless force is set. When a
+    changed file is reprocessed, the image hashes it added last time are
+    released, so its images are only compared with those of other files.
+    """
+    clear_url_memo()
     read_folder = folder
     save_folder = read_folder + '_filtered'
     files = os.listdir(read_folder)
     files = sorted(files)
-    files = [file for file in files if file.endswith('.json')]
+    files = [file for file in files if file.endswith(('.json', '.parquet'))]
     if not os.path.exists(save_folder):
         os.makedirs(save_folder, exist_ok=True)
-    for file in files:
-        read_filepath = os.path.join(read_folder, file)
-        df = pd.read_json(read_filepath)
-        df['text'] = df['text'].astype(str)
-        df = df[~df['text'].str.startswith('RT @')]
-        print(len(df))
-        df['time'] = pd.to_datetime(df['time'], errors='coerce')
-        df = df.sort_values('time')
-        df1 = filter_dataset(df, language)
-        df['image_urls'], df['image_hashes'], df['unique_image_urls'] = zip(*df.progress_apply(lambda row: combine_urls(row, seen_hashes), axis=1))
-        df2 = df[df['unique_image_urls'].apply(lambda x: len(x) > 0)]
-        save_seen_hashes(seen_hashes)
-        save_file1 = file.split('.')[0] + '_text.json'
-        save_file2 = file.split('.')[0] + '_image.json'
-        save_filepath1 = os.path.join(save_folder, save_file1)
-        save_filepath2 = os.path.join(save_folder, save_file2)
-        df1.to_json(save_filepath1, orient='records', lines=True)
-        df2.to_json(save_filepath2, orient='records', lines=True)
-        print(f'{save_file1} and {save_file2} saved')
+    read_filepaths = [os.path.join(read_folder, file) for file in files]
+    params = {'language': language, 'perceptual': perceptual, 'phash_threshold': phash_threshold, 'format': fmt}
+    manifest = Manifest(manifest_path(save_folder))
+    if force:
+        pending = [(read_filepath, manifest.fingerprint(read_filepath)) for read_filepath in read_filepaths]
+    else:
+        pending = manifest.pending(read_filepaths, params)
+    if pending and len(pending) < len(files):
+        print(f'{len(files) - len(pending)} of {len(files)} files unchanged since the last run, skipped')
+    metrics.inc('files_skipped', len(files) - len(pending), stage='process_data')
+    if not pending:
+        manifest.close()
+        return
+    read_filepaths = [read_filepath for read_filepath, _ in pending]
+    args = (read_filepaths, [language] * len(pending), [fetch_options] * len(pending), [perceptual] * len(pending))
+    seen_hashes = get_seen_hashes()
+    near_index = None
+    if perceptual:
+        from perceptual_hash import NearDuplicateIndex
+        near_index = NearDuplicateIndex(perceptual, phash_threshold, seen_hashes)
+    # Workers download and hash images in parallel; the dedup against
+    # seen_hashes is then merged here in file order, as in a serial run.
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=metrics.drain) if workers > 1 else None
+    if executor:
+        results = executor.map(hash_file_in_worker, *args)
+    else:
+        results = (hash_file(*file_args) + (None,) for file_args in zip(*args))
+    total_counts = {'fetched': 0, 'avoided': 0}
+    try:
+        for (read_filepath, fingerprint), (df, df1, counts, worker_metrics) in zip(pending, results):
+            if worker_metrics is not None:
+                metrics.merge(worker_metrics)
+            with metrics.stage('process_data.dedup'):
+                entry = manifest.get(read_filepath)
+                file_hashes, file_index = seen_hashes, near_index
+                if entry is not None and entry['extra']:
+                    file_hashes = ReleasedHashes(seen_hashes, entry['extra']['hashes'])
+                    if near_index is not None:
+                        file_index = ReleasedNearIndex(near_index, entry['extra']['phashes'])
+                df2 = dedup_file(df, file_hashes, file_index)
+                outputs = save_outputs(df1, df2, save_folder, os.path.basename(read_filepath), fmt)
+                manifest.record(read_filepath, fingerprint, outputs, params, added_hashes(df))
+                save_seen_hashes(seen_hashes)
+            metrics.inc('tweets_out', len(df1), stage='process_data', kind='text')
+            metrics.inc('tweets_out', len(df2), stage='process_data', kind='image')
+            metrics.inc('files_processed', stage='process_data')
+            for key in total_counts:
+                total_counts[key] += counts[key]
+    finally:
+        if executor:
+            executor.shutdown()
+        manifest.close()
+    print(f"{total_counts['fetched']} image fetches performed, {total_counts['avoided']} avoided")
 
 
 if __name__ == "__main__":
+    from perceptual_hash import HASH_FUNCTIONS
     parser = argparse.ArgumentParser(description="Filter dataset based on language and detect image duplicates.")
     parser.add_argument("folder", type=str, help="Path to the folder containing JSON files.")
     parser.add_argument("--language", type=str, default="english", choices=["english", "japanese"], help="Language for filtering dataset (default: english)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes used to hash images, one file per task (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent image downloads per process (default: 16)")
+    parser.add_argument("--per-host", type=int, default=8, help="Concurrent image downloads per host (default: 8)")
+    parser.add_argument("--timeout", type=float, default=10, help="Image download timeout in seconds (default: 10)")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per image download, with exponential backoff (default: 3)")
+    parser.add_argument("--image-cache", type=str, default=CACHE_DIR, help=f"Directory of the persistent image cache, or '' to disable it (default: {CACHE_DIR})")
+    parser.add_argument("--cache-size", type=float, default=CACHE_MAX_BYTES / 1024 ** 3, help="Maximum size of the image cache in GB (default: %(default)s)")
+    parser.add_argument("--perceptual-hash", type=str, default=None, choices=sorted(HASH_FUNCTIONS), help="Also drop near-duplicate images using this perceptual hash (default: exact duplicates only)")
+    parser.add_argument("--phash-threshold", type=int, default=8, help="Maximum Hamming distance between perceptual hashes of near duplicates (default: 8)")
+    parser.add_argument("--format", type=str, default="json", choices=FORMATS, help="Output format of the _text and _image files; inputs of either format are read (default: json)")
+    parser.add_argument("--force", action="store_true", help="Process every file, even those the manifest records as unchanged")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS", help="Keep running and process new or changed files every SECONDS (default: run once)")
+    parser.add_argument("--metrics-out", type=str, default=None, help="Write timers and counters to this file after each run, in Prometheus format if it ends with .prom and as JSON otherwise")
+    parser.add_argument("--profile-dir", type=str, default=None, help="Profile each stage with cProfile and write <stage>.prof files to this folder")
     args = parser.parse_args()
-    main(args.folder, args.language)
\ No newline at end of file
+    fetch_options = {'concurrency': args.concurrency, 'per_host': args.per_host, 'timeout': args.timeout, 'retries': args.retries,
+                     'cache_dir': args.image_cache or None, 'cache_max_bytes': int(args.cache_size * 1024 ** 3)}
+    if args.profile_dir:
+        metrics.enable_profiling(args.profile_dir)
+
+    def run(force=False):
+        main(args.folder, args.language, args.workers, fetch_options, args.perceptual_hash, args.phash_threshold, args.format, force)
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
+
+    run(args.force)
+    if args.watch:
+        watch(run, args.watch)
\ No newline at end of file
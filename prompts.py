@@ -15,6 +15,42 @@ image_mmi_prompts = {
                    "2. Provide your reasoning based on the details described in the image.\n"
 }
 
+# batched text MMI classification prompts (several tweets per request)
+text_batch_mmi_prompts = {
+    "Task": "You are a seismic expert. The epicenter of this earthquake is located at {epicenter}. Please assess each of the following {count} texts posted on Twitter for earthquake-related damage based on the Modified Mercalli Intensity (MMI) Scale.\n",
+    "Tweet": "Tweet {index}: {text}\n",
+    "Output_format": "Return only a JSON array with one object per tweet, in this format: [{\"index\": tweet number, \"MMI\": \"your judgment\", \"location\": \"your identification\", \"reason\": \"your reasoning\"}].\n",
+    "Instruction": "1. If a text does not describe any {epicenter} earthquake-caused damage, return 'None' for MMI.\n"
+                   "2. If the damage location is not mentioned in a text, return 'None' for location.\n"
+                   "3. Provide your reasoning based on the details mentioned in each text, in at most two sentences.\n"
+                   "4. Assess every tweet independently and include every tweet number exactly once.\n"
+}
+
+
+def create_text_prompt(epicenter, tweet):
+    """Build the text MMI classification prompt for a tweet."""
+    prompt = text_mmi_prompts['Task'].format(epicenter=epicenter, text=tweet) \
+           + text_mmi_prompts['Output_format'] \
+           + text_mmi_prompts['Instruction'].format(epicenter=epicenter)
+    return prompt
+
+
+def create_text_batch_prompt(epicenter, tweets):
+    """Build one prompt asking for the MMI assessment of several tweets, numbered from 0."""
+    prompt = text_batch_mmi_prompts['Task'].format(epicenter=epicenter, count=len(tweets)) \
+           + ''.join(text_batch_mmi_prompts['Tweet'].format(index=index, text=str(tweet).replace('\n', ' ')) for index, tweet in enumerate(tweets)) \
+           + text_batch_mmi_prompts['Output_format'] \
+           + text_batch_mmi_prompts['Instruction'].format(epicenter=epicenter)
+    return prompt
+
+
+def create_image_prompt(epicenter):
+    """Build the image MMI classification prompt."""
+    prompt = image_mmi_prompts['Task'].format(epicenter=epicenter) \
+           + image_mmi_prompts['Output_format'] \
+           + image_mmi_prompts['Instruction'].format(epicenter=epicenter)
+    return prompt
+
 
 """
 Perhaps there are a lot of factors that should be considered. 
@@ -0,0 +1,87 @@
+import time
+import sqlite3
+import hashlib
+import threading
+import metrics
+from file_hash import file_digest
+
+RESPONSE_CACHE_FILE = 'response_cache.sqlite'
+RESPONSE_CACHE_MAX_ENTRIES = 1000000
+
+
+class ResponseCache:
+    """Persistent cache of model responses keyed on model, input type, prompt and image content.
+
+    Every call uses temperature 0, so a repeated (model, input, prompt, image)
+    gets the same classification and can be answered from disk. Entries are
+    evicted least recently used first once max_entries is exceeded.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_FILE, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, input TEXT, '
+                          'response TEXT NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.conn.commit()
+
+    def key(self, model, input, message, image=None, image_settings=''):
+        """Return the cache key of a request; image is the path of the image file, if any.
+
+        image_settings identifies how the image is preprocessed before upload,
+        so responses computed on a differently prepared image are not reused.
+        """
+        prompt_hash = hashlib.sha256(message.encode('utf-8')).hexdigest()
+        image_hash = f'{file_digest(image)}:{image_settings}' if image else ''
+        return hashlib.sha256(f'{model}|{input}|{prompt_hash}|{image_hash}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key, or None, and count the hit or miss."""
+        with self.lock:
+            row = self.conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc('response_cache_lookups', result='miss')
+                return None
+            self.hits += 1
+            metrics.inc('response_cache_lookups', result='hit')
+            self.conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def lookup(self, model, input, message, image=None, image_settings=''):
+        """Return the cache key of a request and its cached response, or None, counting the hit or miss.
+
+        The key is what put stores a fresh response under after a miss.
+        """
+        key = self.key(model, input, message, image, image_settings)
+        return key, self.get(key)
+
+    def put(self, key, model, input, response):
+        """Store a response and evict the least recently used entries beyond max_entries."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, model, input, response, created, last_access) '
+                              'VALUES (?, ?, ?, ?, ?, ?)', (key, model, input, response, now, now))
+            excess = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute('DELETE FROM responses WHERE key IN '
+                                  '(SELECT key FROM responses ORDER BY last_access LIMIT ?)', (excess,))
+            self.conn.commit()
+
+    def stats(self):
+        """Return the hit and miss counts of this session and the number of cached responses."""
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        """Close the cache database."""
+        self.conn.close()
@@ -1,146 +1,362 @@
 import os
+import gc
 import json
 import pandas as pd
 import argparse
+from functools import lru_cache
+from contextlib import contextmanager
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from table_io import FORMATS, ParquetChunkWriter, table_format, with_format, write_table
+from manifest import Manifest, manifest_path, watch
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+PARSER = 'orjson' if orjson else 'json'
+
+
+def loads(line):
+    """Parse one JSON document with orjson if it is installed, falling back to json for what orjson rejects.
+
+    orjson is stricter than json, e.g. about lone surrogate escapes left by
+    tweets cut in the middle of an emoji, so a line it rejects is retried
+    with json and only invalid if that fails as well.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(line)
+
+NAN = float('nan')
+
+# column -> path of the value in a status object
+STATUS_FIELDS = (('user', ('user', 'screen_name')),
+                 ('user_name', ('user', 'name')),
+                 ('description', ('user', 'description')),
+                 ('location', ('user', 'location')),
+                 ('protected', ('user', 'protected')),
+                 ('verified', ('user', 'verified')),
+                 ('created', ('user', 'created_at')),
+                 ('followers', ('user', 'followers_count')),
+                 ('friends', ('user', 'friends_count')),
+                 ('listed', ('user', 'listed_count')),
+                 ('favourites', ('user', 'favourites_count')),
+                 ('statuses', ('user', 'statuses_count')),
+                 ('default_profile', ('user', 'default_profile')),
+                 ('default_image', ('user', 'default_profile_image')),
+                 ('time', ('created_at',)),
+                 ('id', ('id',)),
+                 ('text', ('full_text',)),
+                 ('retweet_count', ('retweet_count',)),
+                 ('favourite_count', ('favorite_count',)),
+                 ('reply', ('in_reply_to_screen_name',)),
+                 ('language', ('lang',)))
+# prefix -> (key of the embedded status, renamed columns)
+EMBEDDED_STATUSES = {'rt_': ('retweeted_status', {}),
+                     'qt_': ('quoted_status', {'retweet_count': 'retweet'})}
+INT_FIELDS = {'id', 'followers', 'friends', 'listed', 'favourites', 'statuses', 'retweet_count', 'favourite_count'}
+
+STATUS_COLUMNS = [column for column, _ in STATUS_FIELDS]
+TWEET_COLUMNS = (STATUS_COLUMNS
+                 + ['entity_image_url', 'extended_entity_image_urls', 'place', 'latitude', 'longitude']
+                 + [prefix + renames.get(column, column)
+                    for prefix, (_, renames) in EMBEDDED_STATUSES.items() for column in STATUS_COLUMNS])
+
 
 def convert_text(text, rt_text):
     """Convert the text of a tweet to include the text of the retweet."""
     return text.split(':')[0] + ': ' + rt_text if text.startswith('RT @') else text
 
+
+@lru_cache(maxsize=None)
+def compile_fields(fields):
+    """Compile a field spec into one itemgetter per nested object, with the field positions it fills.
+
+    Returns a list of (path, getter, positions): getter(status[path[0]]...)
+    returns a tuple with the values of the fields at positions in the spec.
+    """
+    groups = {}
+    for position, (_, path) in enumerate(fields):
+        groups.setdefault(path[:-1], []).append((position, path[-1]))
+    compiled = []
+    for path, members in groups.items():
+        keys = [key for _, key in members]
+        getter = itemgetter(*keys) if len(keys) > 1 else (lambda obj, key=keys[0]: (obj[key],))
+        compiled.append((path, getter, [position for position, _ in members]))
+    return compiled
+
+
+def project(statuses, fields, prefix='', renames=None):
+    """Return {column: values} for a list of status objects following a field spec.
+
+    Each status is read with one C-level itemgetter call per nested object,
+    and the rows are transposed into columns with zip. A status of None gives
+    NaN in every column, like a missing key does in pd.DataFrame(records).
+    """
+    fields = tuple(fields)
+    renames = renames or {}
+    compiled = compile_fields(fields)
+    missing = (NAN,) * len(fields)
+    rows = []
+    for status in statuses:
+        if status is None:
+            rows.append(missing)
+            continue
+        row = ()
+        for path, getter, _ in compiled:
+            obj = status
+            for key in path:
+                obj = obj[key]
+            row += getter(obj)
+        rows.append(row)
+    values = list(zip(*rows)) if rows else [()] * len(fields)
+    order = [position for _, _, positions in compiled for position in positions]
+    columns = [None] * len(fields)
+    for index, position in enumerate(order):
+        columns[position] = values[index]
+    projected = {}
+    for (column, _), column_values in zip(fields, columns):
+        if prefix and column in INT_FIELDS:
+            column_values = pd.array(column_values, dtype='Int64')
+        projected[prefix + renames.get(column, column)] = column_values
+    return projected
+
+
+def photo_urls(media_list):
+    """Return the https URLs of the photos in a list of media entities."""
+    return [media['media_url_https'] for media in media_list if media['type'] == 'photo']
+
+
 def convert_dataframe(tweets_data):
-    """Extract relevant information from the tweets and convert it to a DataFrame."""
-    tweets_list = []
-    for tweet in tweets_data:
-        # tweet basic information
-        tweet_dict = {'user': tweet['user']['screen_name'],
-                      'user_name': tweet['user']['name'],
-                      'description': tweet['user']['description'],
-                      'location': tweet['user']['location'],
-                      'protected': tweet['user']['protected'],
-                      'verified': tweet['user']['verified'],
-                      'created': tweet['user']['created_at'],
-                      'followers': tweet['user']['followers_count'],
-                      'friends': tweet['user']['friends_count'],
-                      'listed': tweet['user']['listed_count'],
-                      'favourites': tweet['user']['favourites_count'],
-                      'statuses': tweet['user']['statuses_count'],
-                      'default_profile': tweet['user']['default_profile'],
-                      'default_image': tweet['user']['default_profile_image'],
-                      'time': tweet['created_at'],
-                      'id': tweet['id'],
-                      'text': tweet['full_text'],
-                      'retweet_count': tweet['retweet_count'],
-                      'favourite_count': tweet['favorite_count'],
-                      'reply': tweet['in_reply_to_screen_name'],
-                      'language': tweet['lang'], 
-                      'entity_image_url': '',
-                      'extended_entity_image_urls': [],
-                      'place': '',
-                      'latitude': '',
-                      'longitude': ''}
-        
-        # place information
-        if 'place' in tweet:
-            tweet_dict['place'] = tweet['place']
-        if 'coordinates' in tweet and tweet['coordinates'] is not None:
-            tweet['longitude'] = tweet['coordinates']['coordinates'][0]
-            tweet['lattitude'] = tweet['coordinates']['coordinates'][1]
-        
-        # image information
-        if 'entities' in tweet and 'media' in tweet['entities']:
-            for media in tweet['entities']['media']:
-                if media['type'] == 'photo':
-                    tweet_dict['entity_image_url'] = media['media_url_https']
-                    break
-        if 'extended_entities' in tweet and 'media' in tweet['extended_entities']:
-            for media in tweet['extended_entities']['media']:
-                if media['type'] == 'photo':
-                    tweet_dict['extended_entity_image_urls'].append(media['media_url_https'])
-
-        # retweet information
-        if 'retweeted_status' in tweet:
-            tweet_dict['rt_user'] = tweet['retweeted_status']['user']['screen_name']
-            tweet_dict['rt_user_name'] = tweet['retweeted_status']['user']['name']
-            tweet_dict['rt_description'] = tweet['retweeted_status']['user']['description']
-            tweet_dict['rt_location'] = tweet['retweeted_status']['user']['location']
-            tweet_dict['rt_protected'] = tweet['retweeted_status']['user']['protected']
-            tweet_dict['rt_verified'] = tweet['retweeted_status']['user']['verified']
-            tweet_dict['rt_created'] = tweet['retweeted_status']['user']['created_at']
-            tweet_dict['rt_followers'] = tweet['retweeted_status']['user']['followers_count']
-            tweet_dict['rt_friends'] = tweet['retweeted_status']['user']['friends_count']
-            tweet_dict['rt_listed'] = tweet['retweeted_status']['user']['listed_count']
-            tweet_dict['rt_favourites'] = tweet['retweeted_status']['user']['favourites_count']
-            tweet_dict['rt_statuses'] = tweet['retweeted_status']['user']['statuses_count']
-            tweet_dict['rt_default_profile'] = tweet['retweeted_status']['user']['default_profile']
-            tweet_dict['rt_default_image'] = tweet['retweeted_status']['user']['default_profile_image']
-            tweet_dict['rt_time'] = tweet['retweeted_status']['created_at']
-            tweet_dict['rt_id'] = tweet['retweeted_status']['id']
-            tweet_dict['rt_text'] = tweet['retweeted_status']['full_text']
-            tweet_dict['rt_retweet_count'] = tweet['retweeted_status']['retweet_count']
-            tweet_dict['rt_favourite_count'] = tweet['retweeted_status']['favorite_count']            
-            tweet_dict['rt_reply'] = tweet['retweeted_status']['in_reply_to_screen_name']
-            tweet_dict['rt_language'] = tweet['retweeted_status']['lang']
-       
-        # quote information
-        if 'quoted_status' in tweet:
-            tweet_dict['qt_user'] = tweet['quoted_status']['user']['screen_name']
-            tweet_dict['qt_user_name'] = tweet['quoted_status']['user']['name']
-            tweet_dict['qt_description'] = tweet['quoted_status']['user']['description']
-            tweet_dict['qt_location'] = tweet['quoted_status']['user']['location']
-            tweet_dict['qt_protected'] = tweet['quoted_status']['user']['protected']
-            tweet_dict['qt_verified'] = tweet['quoted_status']['user']['verified']
-            tweet_dict['qt_created'] = tweet['quoted_status']['user']['created_at']
-            tweet_dict['qt_followers'] = tweet['quoted_status']['user']['followers_count']
-            tweet_dict['qt_friends'] = tweet['quoted_status']['user']['friends_count']
-            tweet_dict['qt_listed'] = tweet['quoted_status']['user']['listed_count']
-            tweet_dict['qt_favourites'] = tweet['quoted_status']['user']['favourites_count']
-            tweet_dict['qt_statuses'] = tweet['quoted_status']['user']['statuses_count']
-            tweet_dict['qt_default_profile'] = tweet['quoted_status']['user']['default_profile']
-            tweet_dict['qt_default_image'] = tweet['quoted_status']['user']['default_profile_image']
-            tweet_dict['qt_time'] = tweet['quoted_status']['created_at']
-            tweet_dict['qt_id'] = tweet['quoted_status']['id']
-            tweet_dict['qt_text'] = tweet['quoted_status']['full_text']
-            tweet_dict['qt_retweet'] = tweet['quoted_status']['retweet_count']
-            tweet_dict['qt_favourite_count'] = tweet['quoted_status']['favorite_count']    
-            tweet_dict['qt_reply'] = tweet['quoted_status']['in_reply_to_screen_name']
-            tweet_dict['qt_language'] = tweet['quoted_status']['lang']  
-        
-        tweets_list.append(tweet_dict)
-    df = pd.DataFrame(tweets_list)
-    return df
+    """Extract relevant information from the tweets and convert it to a DataFrame.
+
+    The columns of the retweet and quote blocks are only present if at least
+    one tweet has that kind of embedded status, in the order they first
+    appear; ids and counts in those blocks are nullable integers so missing
+    values do not turn them into floats.
+    """
+    if not tweets_data:
+        return pd.DataFrame()
+    columns = project(tweets_data, STATUS_FIELDS)
+
+    # image information
+    columns['entity_image_url'] = [next(iter(photo_urls(tweet['entities']['media'])), '')
+                                   if 'entities' in tweet and 'media' in tweet['entities'] else ''
+                                   for tweet in tweets_data]
+    columns['extended_entity_image_urls'] = [photo_urls(tweet['extended_entities']['media'])
+                                             if 'extended_entities' in tweet and 'media' in tweet['extended_entities'] else []
+                                             for tweet in tweets_data]
+
+    # place information; coordinates are GeoJSON points, [longitude, latitude]
+    columns['place'] = [tweet['place'] if 'place' in tweet else '' for tweet in tweets_data]
+    points = [tweet['coordinates']['coordinates'] if tweet.get('coordinates') else None for tweet in tweets_data]
+    columns['latitude'] = ['' if point is None else point[1] for point in points]
+    columns['longitude'] = ['' if point is None else point[0] for point in points]
+
+    # retweet and quote information
+    blocks = []
+    for prefix, (key, renames) in EMBEDDED_STATUSES.items():
+        statuses = [tweet.get(key) for tweet in tweets_data]
+        first = next((index for index, status in enumerate(statuses) if status is not None), None)
+        if first is not None:
+            blocks.append((first, prefix, statuses, renames))
+    for _, prefix, statuses, renames in sorted(blocks, key=lambda block: block[0]):
+        columns.update(project(statuses, STATUS_FIELDS, prefix, renames))
+    return pd.DataFrame(columns)
+
+
+@contextmanager
+def gc_paused():
+    """Pause the cyclic garbage collector while parsed tweets are built.
+
+    Parsed JSON is acyclic and freed by reference counting, but allocating
+    millions of dicts triggers collections that traverse the whole heap.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def iter_json(filepath):
+    """Yield the tweets of a JSON lines file one at a time, parsed with orjson if it is installed."""
+    parsed = invalid = 0
+    try:
+        with open(filepath, 'rb') as tweets_file:
+            for line in tweets_file:
+                try:
+                    tweet = loads(line)
+                except ValueError:
+                    invalid += 1
+                    continue
+                parsed += 1
+                yield tweet
+    finally:
+        metrics.inc('tweets_in', parsed, stage='retrieve_json')
+        metrics.inc('invalid_lines', invalid, stage='retrieve_json')
 
 
 def read_json(filepath):
     """Read a JSON file and return a list of dictionaries."""
-    tweets_data = list()
-    with open(filepath, 'r') as tweets_file:
-        for line in tweets_file:
-            try:
-                tweet = json.loads(line)
-                tweets_data.append(tweet)
-            except:
-                continue
-    return tweets_data
-
-
-def main(read_folder, save_folder):
-    """Convert the tweet data to a DataFrame and save it to a JSON file."""
+    return list(iter_json(filepath))
+
+
+def iter_chunks(tweets, chunksize):
+    """Yield lists of at most chunksize tweets from an iterable of tweets."""
+    chunk = []
+    for tweet in tweets:
+        chunk.append(tweet)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def convert_texts(df):
+    """Apply convert_text to the text column of a converted DataFrame with vectorized string operations."""
+    if len(df) == 0:
+        return df
+    texts = df['text'].astype(str)
+    rt_texts = df['rt_text'].astype(str) if 'rt_text' in df else 'nan'
+    retweets = texts.str.startswith('RT @')
+    df['text'] = texts.where(~retweets, texts.str.partition(':')[0] + ': ' + rt_texts)
+    return df
+
+
+def stream_file(read_filepath, save_filepath, chunksize):
+    """Convert a tweet file chunk by chunk, keeping at most chunksize tweets in memory.
+
+    The output is written as a JSON array of records, which pd.read_json loads
+    into the same columns as the in-memory path, or as one Parquet row group
+    per chunk if save_filepath ends with .parquet. Reference cycles left by a
+    chunk are collected after it is written.
+    """
+    count = 0
+    tweets = metrics.timed(iter_json(read_filepath), 'parse_seconds', stage='retrieve_json')
+    if table_format(save_filepath) == 'parquet':
+        writer = ParquetChunkWriter(save_filepath, TWEET_COLUMNS)
+        try:
+            with gc_paused():
+                for chunk in iter_chunks(tweets, chunksize):
+                    with metrics.timer('convert_seconds', stage='retrieve_json'):
+                        df = convert_texts(convert_dataframe(chunk))
+                    with metrics.timer('write_seconds', stage='retrieve_json'):
+                        writer.write(df)
+                    count += len(df)
+                    gc.collect(0)
+        finally:
+            writer.close()
+        return count
+    with open(save_filepath, 'w') as save_file, gc_paused():
+        save_file.write('[')
+        for chunk in iter_chunks(tweets, chunksize):
+            with metrics.timer('convert_seconds', stage='retrieve_json'):
+                df = convert_texts(convert_dataframe(chunk))
+            with metrics.timer('write_seconds', stage='retrieve_json'):
+                records = df.to_json(orient='records')[1:-1]
+                if count:
+                    save_file.write(',')
+                save_file.write(records)
+            count += len(df)
+            gc.collect(0)
+        save_file.write(']')
+    return count
+
+
+def process_file(read_filepath, save_filepath, chunksize=None):
+    """Convert a single tweet file and save it to save_filepath."""
+    with metrics.stage('retrieve_json'):
+        if chunksize:
+            count = stream_file(read_filepath, save_filepath, chunksize)
+        else:
+            with gc_paused():
+                with metrics.timer('parse_seconds', stage='retrieve_json'):
+                    tweets_data = read_json(read_filepath)
+                with metrics.timer('convert_seconds', stage='retrieve_json'):
+                    df = convert_dataframe(tweets_data)
+                    df = convert_texts(df)
+            with metrics.timer('write_seconds', stage='retrieve_json'):
+                write_table(df, save_filepath)
+            count = len(df)
+    metrics.inc('tweets_out', count, stage='retrieve_json')
+    metrics.inc('files_processed', stage='retrieve_json')
+
+
+def process_file_in_worker(read_filepath, save_filepath, chunksize=None):
+    """Run process_file in a worker process and return the metrics it recorded, to be merged by the parent."""
+    process_file(read_filepath, save_filepath, chunksize)
+    return metrics.drain()
+
+
+def main(read_folder, save_folder, chunksize=None, workers=1, fmt='json', force=False):
+    """Convert the tweet data to a DataFrame and save it to a JSON file.
+
+    Files already converted with the same format and unchanged since, as
+    recorded in the manifest of save_folder, are skipped unless force is set.
+    """
     files = os.listdir(read_folder)
     files = sorted(files)
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
-    for file in files:
-        read_filepath = os.path.join(read_folder, file)
-        tweets_data = read_json(read_filepath)
-        df = convert_dataframe(tweets_data)
-        df['text'] = df.apply(lambda row: convert_text(str(row['text']), str(row['rt_text'])), axis=1)
-        save_filepath = os.path.join(save_folder, file)
-        df.to_json(save_filepath)
+    read_filepaths = [os.path.join(read_folder, file) for file in files]
+    save_filepaths = {read_filepath: os.path.join(save_folder, file) for read_filepath, file in zip(read_filepaths, files)}
+    if fmt != 'json':
+        save_filepaths = {read_filepath: with_format(save_filepath, fmt) for read_filepath, save_filepath in save_filepaths.items()}
+    params = {'format': fmt}
+    manifest = Manifest(manifest_path(save_folder))
+    try:
+        if force:
+            pending = [(read_filepath, manifest.fingerprint(read_filepath)) for read_filepath in read_filepaths]
+        else:
+            pending = manifest.pending(read_filepaths, params)
+        if pending and len(pending) < len(files):
+            print(f'{len(files) - len(pending)} of {len(files)} files unchanged since the last run, skipped')
+        metrics.inc('files_skipped', len(files) - len(pending), stage='retrieve_json')
+        read_filepaths = [read_filepath for read_filepath, _ in pending]
+        args = (read_filepaths, [save_filepaths[read_filepath] for read_filepath in read_filepaths], [chunksize] * len(pending))
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=metrics.drain) if workers > 1 else None
+        try:
+            results = executor.map(process_file_in_worker, *args) if executor else map(process_file, *args)
+            for (read_filepath, fingerprint), worker_metrics in zip(pending, results):
+                if worker_metrics is not None:
+                    metrics.merge(worker_metrics)
+                manifest.record(read_filepath, fingerprint, [save_filepaths[read_filepath]], params)
+        finally:
+            if executor:
+                executor.shutdown()
+    finally:
+        manifest.close()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Extract tweet information.')
     parser.add_argument('read_folder', type=str, help='The folder to read tweet data from.')
     parser.add_argument('save_folder', type=str, help='The folder to save the converted tweet data.')
+    parser.add_argument('--chunksize', type=int, default=None, help='Stream each file in chunks of this many tweets to bound memory (default: load whole file).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes, one file per task (default: 1).')
+    parser.add_argument('--format', type=str, default='json', choices=FORMATS, help='Output format; parquet keeps typed columns (default: json).')
+    parser.add_argument('--force', action='store_true', help='Convert every file, even those the manifest records as unchanged.')
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS', help='Keep running and convert new or changed files every SECONDS (default: run once).')
+    parser.add_argument('--metrics-out', type=str, default=None, help='Write timers and counters to this file after each run, in Prometheus format if it ends with .prom and as JSON otherwise.')
+    parser.add_argument('--profile-dir', type=str, default=None, help='Profile the conversion with cProfile and write retrieve_json.prof to this folder.')
     args = parser.parse_args()
-    main(args.read_folder, args.save_folder)
\ No newline at end of file
+    if args.profile_dir:
+        metrics.enable_profiling(args.profile_dir)
+
+    def run(force=False):
+        main(args.read_folder, args.save_folder, args.chunksize, args.workers, args.format, force)
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
+
+    run(args.force)
+    if args.watch:
+        watch(run, args.watch)
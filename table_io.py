@@ -0,0 +1,137 @@
+import os
+import json
+import pandas as pd
+
+FORMATS = ['json', 'parquet']
+EXTENSIONS = {'json': '.json', 'parquet': '.parquet'}
+
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+STATUS_PREFIXES = ['', 'rt_', 'qt_']
+TIME_COLUMNS = {prefix + name for prefix in STATUS_PREFIXES for name in ['time', 'created']}
+INT_COLUMNS = {prefix + name for prefix in STATUS_PREFIXES
+               for name in ['id', 'followers', 'friends', 'listed', 'favourites', 'statuses', 'retweet_count', 'favourite_count']} | {'qt_retweet'}
+BOOL_COLUMNS = {prefix + name for prefix in STATUS_PREFIXES for name in ['protected', 'verified', 'default_profile', 'default_image']}
+FLOAT_COLUMNS = {'latitude', 'longitude'}
+LIST_COLUMNS = {'extended_entity_image_urls', 'image_urls', 'image_hashes', 'unique_image_urls',
+                'image_phashes', 'near_unique_image_urls', 'damage_terms'}
+
+
+def table_format(filepath):
+    """Return the table format of a file from its extension."""
+    return 'parquet' if filepath.endswith(EXTENSIONS['parquet']) else 'json'
+
+
+def with_format(filepath, fmt):
+    """Return filepath with the extension of the given table format."""
+    return os.path.splitext(filepath)[0] + EXTENSIONS[fmt]
+
+
+def is_missing(value):
+    """Return True for None, float NaN and the pandas NA and NaT scalars."""
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value)
+
+
+def to_timestamps(values):
+    """Parse Twitter time strings (or already parsed times) into UTC timestamps."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        times = values
+    else:
+        times = pd.to_datetime(values, format=TWITTER_TIME_FORMAT, errors='coerce', utc=True)
+    if times.dt.tz is None:
+        times = times.dt.tz_localize('UTC')
+    return times.dt.tz_convert('UTC')
+
+
+def to_list(value):
+    """Return a list-of-strings column value, keeping nulls inside the list."""
+    if is_missing(value) or isinstance(value, str):
+        return None
+    return [None if is_missing(item) else str(item) for item in value]
+
+
+def to_string(value):
+    """Return a string column value, JSON-encoding nested objects such as place."""
+    if is_missing(value):
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value.tolist() if hasattr(value, 'tolist') else value)
+
+
+def arrow_type(name):
+    """Return the Arrow type of a column."""
+    import pyarrow as pa
+    if name in TIME_COLUMNS:
+        return pa.timestamp('ms', tz='UTC')
+    if name in INT_COLUMNS:
+        return pa.int64()
+    if name in BOOL_COLUMNS:
+        return pa.bool_()
+    if name in FLOAT_COLUMNS:
+        return pa.float64()
+    if name in LIST_COLUMNS:
+        return pa.list_(pa.string())
+    return pa.string()
+
+
+def to_arrow(df, columns=None):
+    """Convert a tweet DataFrame to a typed Arrow table, adding missing columns as nulls."""
+    import pyarrow as pa
+    columns = list(df.columns) if columns is None else columns
+    arrays = []
+    for name in columns:
+        values = df[name] if name in df else pd.Series([None] * len(df), index=df.index, dtype=object)
+        if name in TIME_COLUMNS:
+            values = to_timestamps(values)
+        elif name in INT_COLUMNS:
+            values = pd.to_numeric(values, errors='coerce').astype('Int64')
+        elif name in BOOL_COLUMNS:
+            values = [None if is_missing(value) else bool(value) for value in values]
+        elif name in FLOAT_COLUMNS:
+            values = pd.to_numeric(values, errors='coerce')
+        elif name in LIST_COLUMNS:
+            values = [to_list(value) for value in values]
+        else:
+            values = [to_string(value) for value in values]
+        arrays.append(pa.array(values, type=arrow_type(name), from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=pa.schema([(name, arrow_type(name)) for name in columns]))
+
+
+def write_table(df, filepath, lines=False):
+    """Write a DataFrame as Parquet or JSON depending on the extension of filepath."""
+    if table_format(filepath) == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(to_arrow(df), filepath)
+    elif lines:
+        df.to_json(filepath, orient='records', lines=True)
+    else:
+        df.to_json(filepath)
+
+
+def read_table(filepath, columns=None, lines=False):
+    """Read a Parquet or JSON table, loading only the given columns from Parquet; columns the table lacks are left out."""
+    if table_format(filepath) == 'parquet':
+        if columns is not None:
+            import pyarrow.parquet as pq
+            names = set(pq.read_schema(filepath).names)
+            columns = [column for column in columns if column in names]
+        return pd.read_parquet(filepath, columns=columns, memory_map=True, dtype_backend='numpy_nullable')
+    df = pd.read_json(filepath, lines=lines)
+    return df if columns is None else df[[column for column in columns if column in df]]
+
+
+class ParquetChunkWriter:
+    """Append DataFrame chunks to one Parquet file under a fixed typed schema."""
+
+    def __init__(self, filepath, columns):
+        import pyarrow.parquet as pq
+        self.columns = columns
+        self.writer = pq.ParquetWriter(filepath, to_arrow(pd.DataFrame(), columns).schema)
+
+    def write(self, df):
+        """Write a chunk as a new row group."""
+        self.writer.write_table(to_arrow(df, self.columns))
+
+    def close(self):
+        """Finish the Parquet file."""
+        self.writer.close()
@@ -0,0 +1,165 @@
+import json
+import pytest
+import pandas as pd
+import classify
+import models
+from job_log import read_results
+from response_cache import ResponseCache
+from benchmarks import mock_llm_server
+
+EPICENTER = 'Ridgecrest, CA'
+
+
+@pytest.fixture
+def llm_server(tmp_path, monkeypatch):
+    """Start the mock LLM server and point the OpenAI client at it, with fast retries."""
+    server = mock_llm_server.start_server()
+    secret_file = tmp_path / 'secrets.txt'
+    secret_file.write_text('openai_key, test\n')
+    monkeypatch.setenv('OPENAI_BASE_URL', f'http://127.0.0.1:{server.server_port}/v1')
+    monkeypatch.setattr(models, 'SECRET_FILE', str(secret_file))
+    monkeypatch.setattr(models, 'retry_policy', models.RetryPolicy(base_delay=0.01))
+    monkeypatch.setattr(models, 'retry_budget', models.RetryBudget())
+    monkeypatch.setattr(models, 'circuit_breakers', {'openai': models.CircuitBreaker(), 'gemini': models.CircuitBreaker()})
+    models.load_secrets.cache_clear()
+    models.get_openai_client.cache_clear()
+    yield server
+    server.shutdown()
+    server.server_close()
+    models.load_secrets.cache_clear()
+    models.get_openai_client.cache_clear()
+
+
+def text_rows(count):
+    return [{'id': tweet_id, 'text': f'Tweet {tweet_id}: the walls cracked'} for tweet_id in range(1, count + 1)]
+
+
+def results_by_id(output_path):
+    return {result['id']: result for result in read_results(output_path)}
+
+
+def test_image_rows_prefer_near_unique_image_urls(tmp_path):
+    df = pd.DataFrame({'id': [1, 2, 3],
+                       'unique_image_urls': [['a', 'b'], ['c'], ['d']],
+                       'near_unique_image_urls': [['b'], [], None]})
+    df.to_parquet(tmp_path / 'x_image.parquet')
+    rows = list(classify.iter_rows(str(tmp_path), 'image'))
+    assert rows == [{'id': 1, 'image_url': 'b'}, {'id': 3, 'image_url': 'd'}]
+
+
+def test_image_rows_without_perceptual_hashing_use_unique_image_urls(tmp_path):
+    df = pd.DataFrame({'id': [1, 2], 'unique_image_urls': [['a', 'b'], []]})
+    df.to_parquet(tmp_path / 'x_image.parquet')
+    assert list(classify.iter_rows(str(tmp_path), 'image')) == [{'id': 1, 'image_url': 'a'}]
+
+
+def test_results_are_written_to_the_log(llm_server, tmp_path):
+    output_path = str(tmp_path / 'results.jsonl')
+    count, skipped = classify.run_batch(text_rows(5), 'gpt4', 'text', EPICENTER, output_path, concurrency=4)
+    assert (count, skipped) == (5, 0)
+    results = results_by_id(output_path)
+    assert sorted(results) == [1, 2, 3, 4, 5]
+    assert all(result['response'] == mock_llm_server.RESPONSE and result['error'] is None for result in results.values())
+
+
+def test_resumed_run_skips_completed_ids(llm_server, tmp_path):
+    output_path = str(tmp_path / 'results.jsonl')
+    classify.run_batch(text_rows(3), 'gpt4', 'text', EPICENTER, output_path)
+    requests_before = llm_server.requests
+    count, skipped = classify.run_batch(text_rows(5), 'gpt4', 'text', EPICENTER, output_path)
+    assert (count, skipped) == (2, 3)
+    assert llm_server.requests - requests_before == 2
+    assert sorted(results_by_id(output_path)) == [1, 2, 3, 4, 5]
+
+
+def test_rate_limited_requests_are_retried(llm_server, tmp_path):
+    llm_server.fail_every = 2
+    output_path = str(tmp_path / 'results.jsonl')
+    count, _ = classify.run_batch(text_rows(6), 'gpt4', 'text', EPICENTER, output_path, concurrency=2)
+    assert count == 6
+    assert all(result['response'] == mock_llm_server.RESPONSE for result in results_by_id(output_path).values())
+    assert llm_server.requests > 6
+
+
+def test_rows_missing_from_a_batch_answer_fall_back_to_single_calls(llm_server, tmp_path):
+    llm_server.drop_rate = 1.0
+    output_path = str(tmp_path / 'results.jsonl')
+    count, _ = classify.run_batch(text_rows(8), 'gpt4', 'text', EPICENTER, output_path, concurrency=2, batch_size=4)
+    assert count == 8
+    results = results_by_id(output_path)
+    assert all(result['fallback'] and result['response'] == mock_llm_server.RESPONSE for result in results.values())
+    assert llm_server.requests == 2 + 8
+
+
+def batch_answer(indices):
+    return json.dumps([{'index': index, 'MMI': 'VI', 'location': 'Ridgecrest, CA', 'reason': "It's cracked. {Really}."}
+                       for index in indices])
+
+
+def test_cut_off_batch_answer_keeps_complete_entries():
+    response = batch_answer(range(6))
+    cut = response[:response.index('{"index": 4') + 30]
+    answers = classify.parse_batch_response(cut, 6)
+    assert sorted(answers) == [0, 1, 2, 3]
+    assert answers[0]['reason'] == "It's cracked. {Really}."
+    assert classify.parse_batch_response(response, 6).keys() == set(range(6))
+
+
+def test_cut_off_batch_answer_only_falls_back_for_missing_rows(llm_server, tmp_path):
+    limits = []
+
+    def respond(request):
+        if 'Tweet 0:' in request['messages'][0]['content']:
+            limits.append(request['max_tokens'])
+            response = batch_answer(range(20))
+            return response[:response.index('{"index": 15')]
+        return mock_llm_server.RESPONSE
+
+    llm_server.respond = respond
+    output_path = str(tmp_path / 'results.jsonl')
+    count, _ = classify.run_batch(text_rows(20), 'gpt4', 'text', EPICENTER, output_path, batch_size=20)
+    assert count == 20
+    results = results_by_id(output_path)
+    assert sum(bool(result.get('fallback')) for result in results.values()) == 5
+    assert llm_server.requests == 1 + 5
+    assert limits == [classify.batch_response_tokens(20)] and limits[0] > models.RESPONSE_TOKENS
+
+
+def test_batched_answers_are_split_per_row(llm_server, tmp_path):
+    output_path = str(tmp_path / 'results.jsonl')
+    count, _ = classify.run_batch(text_rows(8), 'gpt4', 'text', EPICENTER, output_path, concurrency=2, batch_size=4)
+    assert count == 8
+    results = results_by_id(output_path)
+    assert all(result['batch_size'] == 4 and not result.get('fallback') for result in results.values())
+    assert llm_server.requests == 2
+
+
+def test_batches_share_the_single_tweet_cache(llm_server, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    classify.run_batch(text_rows(3), 'gpt4', 'text', EPICENTER, str(tmp_path / 'single.jsonl'), cache=cache)
+    assert llm_server.requests == 3
+    output_path = str(tmp_path / 'batched.jsonl')
+    count, _ = classify.run_batch(text_rows(8), 'gpt4', 'text', EPICENTER, output_path, batch_size=8, cache=cache)
+    assert count == 8 and llm_server.requests == 4
+    results = results_by_id(output_path)
+    assert [tweet_id for tweet_id, result in results.items() if result.get('cached')] == [1, 2, 3]
+    assert all(result['batch_size'] == 5 for tweet_id, result in results.items() if tweet_id > 3)
+    count, _ = classify.run_batch(text_rows(8), 'gpt4', 'text', EPICENTER, str(tmp_path / 'single_again.jsonl'), cache=cache)
+    assert count == 8 and llm_server.requests == 4
+
+
+class FailingFetcher:
+    def path(self, url):
+        raise OSError('disk full')
+
+
+def test_task_exceptions_are_logged_as_errors(tmp_path):
+    output_path = str(tmp_path / 'results.jsonl')
+    rows = [{'id': 1, 'image_url': 'http://example.invalid/1.jpg'}, {'id': 2, 'image_url': 'http://example.invalid/2.jpg'}]
+    count, skipped = classify.run_batch(rows, 'gpt4', 'image', 'Ridgecrest, CA', output_path, concurrency=2,
+                                        fetcher=FailingFetcher())
+    assert (count, skipped) == (2, 0)
+    results = sorted(read_results(output_path), key=lambda result: result['id'])
+    assert [result['id'] for result in results] == [1, 2]
+    assert all(result['response'] is None and result['error'] == 'OSError: disk full' for result in results)
+    assert results[0]['image_url'] == 'http://example.invalid/1.jpg'
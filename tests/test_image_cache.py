@@ -0,0 +1,27 @@
+from image_cache import ImageCache
+
+
+def stored_bytes(cache):
+    return cache.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+
+def test_running_total_matches_the_blobs(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=10 ** 6)
+    cache.put('a', b'x' * 100)
+    cache.put('b', b'x' * 100)
+    cache.put('a', b'y' * 300)
+    assert cache.size() == stored_bytes(cache) == 400
+    cache.close()
+    reopened = ImageCache(str(tmp_path), max_bytes=10 ** 6)
+    assert reopened.size() == 400
+
+
+def test_eviction_removes_least_recently_used_blobs(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=250)
+    cache.put('a', b'a' * 100)
+    cache.put('b', b'b' * 100)
+    cache.get('a')
+    cache.put('c', b'c' * 100)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'a' * 100 and cache.get('c') == b'c' * 100
+    assert cache.size() == stored_bytes(cache) == 200
@@ -0,0 +1,20 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+
+
+def run_stage(name):
+    with metrics.stage(name):
+        sum(range(1000))
+    return os.getpid()
+
+
+def test_worker_processes_write_their_own_profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics.registry, 'profile_dir', None)
+    monkeypatch.setattr(metrics.registry, 'profile_pid', None)
+    monkeypatch.setattr(metrics.registry, 'profiles', {})
+    metrics.enable_profiling(str(tmp_path))
+    run_stage('parent')
+    with ProcessPoolExecutor(max_workers=2, initializer=metrics.drain) as executor:
+        pids = set(executor.map(run_stage, ['worker'] * 4))
+    assert sorted(os.listdir(tmp_path)) == sorted(['parent.prof'] + [f'worker.{pid}.prof' for pid in pids])
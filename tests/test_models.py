@@ -0,0 +1,21 @@
+from models import RetryBudget
+
+
+def test_retry_budget_does_not_bank_retries_beyond_max_tokens():
+    budget = RetryBudget(ratio=0.2, max_tokens=10)
+    for _ in range(10000):
+        budget.deposit()
+    retries = 0
+    while budget.withdraw():
+        retries += 1
+    assert retries == 10
+
+
+def test_retry_budget_refills_at_ratio_of_calls():
+    budget = RetryBudget(ratio=0.2, max_tokens=10)
+    while budget.withdraw():
+        pass
+    for _ in range(5):
+        budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
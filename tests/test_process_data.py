@@ -0,0 +1,44 @@
+from io import BytesIO
+from PIL import Image
+import process_data
+
+
+def png_bytes(color):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FlakyFetcher:
+    """Serves a PNG per URL, except that each URL in failing fails on its first fetch."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.fetched = []
+
+    def fetch_all(self, urls, transform):
+        results = {}
+        for url in dict.fromkeys(urls):
+            self.fetched.append(url)
+            if url in self.failing:
+                self.failing.discard(url)
+                results[url] = None
+            else:
+                results[url] = transform(png_bytes(url.rsplit('/', 1)[1]) if url.endswith(('red', 'blue')) else b'not an image')
+        return results
+
+
+def test_failed_urls_are_fetched_again():
+    process_data.clear_url_memo()
+    fetcher = FlakyFetcher(failing=['http://x/red'])
+    hashes = process_data.hash_urls(['http://x/red', 'http://x/blue', 'http://x/broken'], fetcher, progress=False)
+    assert hashes[0] is None and hashes[1] is not None and hashes[2] is None
+    assert process_data.hash_urls(['http://x/red', 'http://x/blue'], fetcher, progress=False)[0] is not None
+    assert fetcher.fetched == ['http://x/red', 'http://x/blue', 'http://x/broken', 'http://x/red']
+
+
+def test_clear_url_memo_resets_the_memo_and_counts():
+    process_data.hash_urls(['http://x/blue', 'http://x/blue'], FlakyFetcher(), progress=False)
+    process_data.clear_url_memo()
+    assert not process_data.url_hashes and not process_data.url_phashes
+    assert process_data.fetch_counts == {'fetched': 0, 'avoided': 0}
@@ -0,0 +1,22 @@
+from image_preprocess import ImagePreprocessor
+from response_cache import ResponseCache
+
+
+def test_image_keys_depend_on_preprocessing_settings(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    image = tmp_path / 'image.jpg'
+    image.write_bytes(b'not really a jpeg')
+    keys = {cache.key('gpt4', 'image', 'prompt', str(image), preprocessor.settings())
+            for preprocessor in (ImagePreprocessor(1024, 'jpeg', 85), ImagePreprocessor(512, 'jpeg', 85),
+                                 ImagePreprocessor(1024, 'webp', 85), ImagePreprocessor(1024, 'jpeg', 70))}
+    assert len(keys) == 4
+    assert cache.key('gpt4', 'text', 'prompt') == cache.key('gpt4', 'text', 'prompt', None, '1024:jpeg:85')
+
+
+def test_lookup_returns_the_key_put_stores_under(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    key, response = cache.lookup('gpt4', 'text', 'prompt')
+    assert response is None and key == cache.key('gpt4', 'text', 'prompt')
+    cache.put(key, 'gpt4', 'text', 'answer')
+    assert cache.lookup('gpt4', 'text', 'prompt') == (key, 'answer')
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
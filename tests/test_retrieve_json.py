@@ -0,0 +1,19 @@
+import json
+import pytest
+import retrieve_json
+
+
+def test_loads_accepts_lone_surrogate_escapes():
+    line = b'{"id": 1, "full_text": "cut mid-emoji \\ud83d"}'
+    assert retrieve_json.loads(line) == json.loads(line)
+
+
+def test_iter_json_skips_only_lines_json_rejects(tmp_path):
+    path = tmp_path / 'tweets.json'
+    path.write_bytes(b'{"id": 1, "full_text": "x\\ud83d y"}\nnot json\n{"id": 2}\n')
+    assert [tweet['id'] for tweet in retrieve_json.iter_json(str(path))] == [1, 2]
+
+
+def test_loads_still_rejects_invalid_json():
+    with pytest.raises(ValueError):
+        retrieve_json.loads(b'{"id": ')